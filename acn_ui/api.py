@@ -1,6 +1,9 @@
+import json
 import os
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
+import numpy as np
 import requests
 
 
@@ -20,9 +23,11 @@ class DormmonAPI:
         headers = kwargs.pop("headers", {})
         headers.setdefault("Accept", "application/json")
         try:
+            started = time.perf_counter()
             response = requests.request(
                 method, url, timeout=self.timeout, headers=headers, **kwargs
             )
+            self._log_timing(method, path, response, time.perf_counter() - started)
             response.raise_for_status()
         except requests.HTTPError as exc:
             message = self._extract_error_message(exc.response)
@@ -35,6 +40,33 @@ class DormmonAPI:
         except ValueError as exc:
             raise APIError("Invalid JSON payload returned by server") from exc
 
+    @staticmethod
+    def _log_timing(method: str, path: str, response: requests.Response, elapsed: float):
+        """Print the server's Server-Timing breakdown next to our round-trip time."""
+        header = response.headers.get("Server-Timing")
+        if not header:
+            return
+        stages = {}
+        for entry in header.split(","):
+            name, _, params = entry.strip().partition(";")
+            key, _, value = params.partition("=")
+            if key.strip() != "dur":
+                continue
+            try:
+                stages[name] = float(value)
+            except ValueError:
+                # Timing is diagnostics only; never fail a response over it
+                continue
+        rtt = elapsed * 1000.0
+        server = stages.get("total", 0.0)
+        breakdown = " ".join(
+            f"{name}={duration:.0f}" for name, duration in stages.items() if name != "total"
+        )
+        print(
+            f"{method} {path} {response.status_code}: rtt={rtt:.0f}ms "
+            f"server={server:.0f}ms network={max(0.0, rtt - server):.0f}ms [{breakdown}]"
+        )
+
     @staticmethod
     def _extract_error_message(response: Optional[requests.Response]) -> str:
         if response is None:
@@ -59,6 +91,10 @@ class DormmonAPI:
     def get_events(self, **params) -> List[Dict[str, Any]]:
         return self._request("GET", "/events", params=params).get("events", [])
 
+    def get_events_page(self, **params) -> Dict[str, Any]:
+        """One page of events plus the `before`/`after` cursors of its neighbours."""
+        return self._request("GET", "/events", params=params)
+
     def create_event(
         self,
         payload: Dict[str, Any],
@@ -79,10 +115,41 @@ class DormmonAPI:
         files = {"photo": (filename, photo_bytes, "image/jpeg")}
         return self._request("POST", "/events", data=form_data, files=files)
 
+    def create_events_batch(
+        self, events: Sequence[Tuple[Dict[str, Any], bytes]]
+    ) -> Dict[str, Any]:
+        """Upload buffered (payload, photo) events; the server stores all or none."""
+        entries = []
+        files = []
+        for idx, (payload, photo_bytes) in enumerate(events):
+            part = f"photo{idx}"
+            entries.append({**payload, "photo": part})
+            files.append((part, (f"event{idx}.jpg", photo_bytes, "image/jpeg")))
+        data = {"events": json.dumps(entries)}
+        return self._request("POST", "/events/batch", data=data, files=files)
+
     def perform_face_recognition(self, photo_bytes: bytes) -> Dict[str, Any]:
         files = {"photo": ("snapshot.jpg", photo_bytes, "image/jpeg")}
         return self._request("POST", "/face/recognize", files=files)
 
+    def perform_batch_face_recognition(self, frames: List[bytes]) -> Dict[str, Any]:
+        """Submit several frames of the same person for a voted identity."""
+        files = [
+            ("photos", (f"frame{idx}.jpg", frame, "image/jpeg"))
+            for idx, frame in enumerate(frames)
+        ]
+        return self._request("POST", "/face/recognize/batch", files=files)
+
+    def perform_encoding_recognition(self, encoding: Sequence[float]) -> Dict[str, Any]:
+        """Match a locally computed 128-d face encoding, skipping the image upload."""
+        data = np.asarray(encoding, dtype="<f4").tobytes()
+        return self._request(
+            "POST",
+            "/face/recognize/encoding",
+            data=data,
+            headers={"Content-Type": "application/octet-stream"},
+        )
+
     def get_schedule(self) -> List[Dict[str, Any]]:
         return self._request("GET", "/schedule").get("schedule", [])
 
@@ -0,0 +1,257 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+import cv2
+import face_recognition
+import numpy as np
+
+TRACK_MIN_SCORE = 0.6  # Correlation below this triggers a full detection
+KEEPALIVE_FRAMES = 10  # Full detection at least every N processed frames
+SEARCH_MARGIN = 0.5  # Search window around the last box, as a share of its size
+PROCESS_INTERVAL = 0.1  # Seconds between processed frames (caps worker CPU)
+IDLE_TIMEOUT = 60.0  # Seconds without use before the camera is released
+WARMUP_FRAMES = 15  # Frames discarded after opening while exposure settles
+RING_SIZE = 5  # Recent frames kept for snapshots
+
+
+class LatestFrame:
+  """Single-slot buffer: writers overwrite, readers always get the newest frame."""
+
+  def __init__(self):
+    self._cond = threading.Condition()
+    self._frame = None
+    self._seq = 0
+
+  def put(self, frame: np.ndarray):
+    with self._cond:
+      self._frame = frame
+      self._seq += 1
+      self._cond.notify_all()
+
+  def get(self) -> Tuple[int, Optional[np.ndarray]]:
+    with self._cond:
+      return self._seq, self._frame
+
+  def wait_newer(self, seq: int, timeout: float = 0.5) -> Tuple[int, Optional[np.ndarray]]:
+    """Block until a frame newer than `seq` arrives (or timeout)."""
+    with self._cond:
+      self._cond.wait_for(lambda: self._seq > seq, timeout=timeout)
+      return self._seq, self._frame
+
+
+class CameraService:
+  """
+  Owns the camera for the whole kiosk.
+
+  A background thread keeps reading (already rotated) frames into a
+  latest-frame buffer and a small ring of recent frames, so pages get a warm
+  frame instantly instead of opening the device and discarding warm-up frames
+  each time. The device is released after IDLE_TIMEOUT seconds without use
+  and reopened transparently on the next request.
+  """
+
+  def __init__(self, device: int = 0, idle_timeout: float = IDLE_TIMEOUT):
+    self.device = device
+    self.idle_timeout = idle_timeout
+    self.frames = LatestFrame()
+    self.error = None
+    self._recent = deque(maxlen=RING_SIZE)
+    self._lock = threading.Lock()
+    self._thread = None
+    self._ready = threading.Event()
+    self._stop_event = threading.Event()
+    self._last_used = time.monotonic()
+
+  @property
+  def running(self) -> bool:
+    return self._thread is not None and self._thread.is_alive()
+
+  def start(self):
+    """Open the camera in the background if it is not already running."""
+    self.keep_alive()
+    with self._lock:
+      if self.running:
+        return
+      self.error = None
+      self._ready.clear()
+      self._stop_event.clear()
+      self._thread = threading.Thread(target=self._run, daemon=True)
+      self._thread.start()
+
+  def stop(self):
+    self._stop_event.set()
+
+  def keep_alive(self):
+    self._last_used = time.monotonic()
+
+  def latest(self) -> Optional[np.ndarray]:
+    """Newest frame, or None while the camera is still warming up."""
+    self.keep_alive()
+    return self.frames.get()[1]
+
+  def snapshot(self, timeout: float = 5.0) -> np.ndarray:
+    """Return the sharpest recent frame, starting the camera if needed."""
+    self.start()
+    if not self._ready.wait(timeout) or self.error:
+      raise RuntimeError(self.error or "Camera did not start in time")
+    with self._lock:
+      recent = list(self._recent)
+    if not recent:
+      raise RuntimeError("Camera stopped before a frame was captured")
+    return max(recent, key=sharpness)
+
+  def _run(self):
+    cap = cv2.VideoCapture(self.device)
+    try:
+      if not cap.isOpened():
+        self.error = "Camera not available"
+        return
+      warmup = WARMUP_FRAMES
+      while not self._stop_event.is_set():
+        if time.monotonic() - self._last_used > self.idle_timeout:
+          return
+        ret, frame = cap.read()
+        if not ret:
+          self.error = "Unable to read from camera"
+          return
+        # Sometimes the webcam doesn't adjust in time, skip the first frames
+        if warmup > 0:
+          warmup -= 1
+          continue
+        frame = cv2.rotate(frame, cv2.ROTATE_90_COUNTERCLOCKWISE)
+        with self._lock:
+          self._recent.append(frame)
+        self.frames.put(frame)
+        self._ready.set()
+    finally:
+      cap.release()
+      with self._lock:
+        self._recent.clear()
+      self.frames.put(None)
+      # Wake up snapshot() waiters so they see the error
+      self._ready.set()
+
+
+def sharpness(frame: np.ndarray) -> float:
+  gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+  return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+class Detection(NamedTuple):
+  seq: int  # Sequence number of the analysed frame
+  frame: np.ndarray  # The analysed BGR frame
+  locations: List[tuple]  # (top, right, bottom, left) face boxes
+  tracked: bool = False  # True when the box came from the tracker
+
+
+class FaceTracker:
+  """
+  Follows one face box between detections with normalized cross-correlation
+  (cv2.matchTemplate) inside a window around the last known position.
+  """
+
+  def __init__(self, min_score: float = TRACK_MIN_SCORE, margin: float = SEARCH_MARGIN):
+    self.min_score = min_score
+    self.margin = margin
+    self.template = None
+    self.location = None
+
+  @property
+  def active(self) -> bool:
+    return self.template is not None
+
+  def reset(self, gray: np.ndarray, location: tuple):
+    top, right, bottom, left = location
+    h, w = gray.shape[:2]
+    top, left = max(top, 0), max(left, 0)
+    bottom, right = min(bottom, h), min(right, w)
+    if bottom - top < 8 or right - left < 8:
+      self.clear()
+      return
+    self.template = gray[top:bottom, left:right].copy()
+    self.location = (top, right, bottom, left)
+
+  def clear(self):
+    self.template = None
+    self.location = None
+
+  def update(self, gray: np.ndarray) -> Optional[tuple]:
+    """Return the new box, or None when the match is not confident enough."""
+    top, right, bottom, left = self.location
+    th, tw = self.template.shape[:2]
+    h, w = gray.shape[:2]
+    dy, dx = int(th * self.margin), int(tw * self.margin)
+    y0, x0 = max(top - dy, 0), max(left - dx, 0)
+    y1, x1 = min(bottom + dy, h), min(right + dx, w)
+    window = gray[y0:y1, x0:x1]
+    if window.shape[0] < th or window.shape[1] < tw:
+      return None
+
+    scores = cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED)
+    _, score, _, (x, y) = cv2.minMaxLoc(scores)
+    if score < self.min_score:
+      return None
+    self.location = (y0 + y, x0 + x + tw, y0 + y + th, x0 + x)
+    return self.location
+
+
+class DetectionWorker(threading.Thread):
+  """
+  Runs face detection on the newest captured frame, off the Tk main loop.
+  Frames that arrive while a detection is running are skipped, so detection
+  cost never backs up the preview. Between full detections the face box is
+  followed by a FaceTracker; HOG only re-runs when tracking confidence drops
+  or every KEEPALIVE_FRAMES processed frames.
+  """
+
+  def __init__(self, buffer: LatestFrame, transform: Callable = None):
+    super().__init__(daemon=True)
+    self.buffer = buffer
+    self.transform = transform
+    self.tracker = FaceTracker()
+    self._lock = threading.Lock()
+    self._latest: Optional[Detection] = None
+    self._stop_event = threading.Event()
+
+  def run(self):
+    seq = 0
+    frames_since_detection = 0
+    while not self._stop_event.is_set():
+      new_seq, frame = self.buffer.wait_newer(seq)
+      if new_seq == seq or frame is None:
+        continue
+      seq = new_seq
+      started = time.monotonic()
+      if self.transform is not None:
+        frame = self.transform(frame)
+      gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+      location = None
+      if self.tracker.active and frames_since_detection < KEEPALIVE_FRAMES:
+        location = self.tracker.update(gray)
+
+      if location is not None:
+        frames_since_detection += 1
+        detection = Detection(seq, frame, [location], tracked=True)
+      else:
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        locations = face_recognition.face_locations(rgb)
+        frames_since_detection = 0
+        if len(locations) == 1:
+          self.tracker.reset(gray, locations[0])
+        else:
+          self.tracker.clear()
+        detection = Detection(seq, frame, locations)
+
+      with self._lock:
+        self._latest = detection
+      self._stop_event.wait(max(0.0, PROCESS_INTERVAL - (time.monotonic() - started)))
+
+  def latest(self) -> Optional[Detection]:
+    with self._lock:
+      return self._latest
+
+  def stop(self):
+    self._stop_event.set()
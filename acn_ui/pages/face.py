@@ -1,18 +1,20 @@
 import threading
+import time
 import tkinter as tk
 
 import cv2
-import face_recognition
 import numpy as np
 import ttkbootstrap as ttk
 from PIL import Image, ImageTk
 
 from api import APIError
+from capture import DetectionWorker
 
 FONT = cv2.FONT_HERSHEY_PLAIN
-PROCESS_PERIOD = 5
-MAX_PROCESS_TIME = 100
+PREVIEW_INTERVAL_MS = 33
+NO_FACE_TIMEOUT = 5.0  # Seconds without a face before the camera stops
 COUNTDOWN_START = 8
+BATCH_FRAMES = 3  # Best countdown frames submitted for recognition
 
 
 def resize_with_pad(image: np.ndarray, size=(320, 240), color=(0, 0, 0)):
@@ -35,6 +37,17 @@ def resize_with_pad(image: np.ndarray, size=(320, 240), color=(0, 0, 0)):
   return padded
 
 
+def frame_quality(frame: np.ndarray, location) -> float:
+  """Score a frame by face size and sharpness (variance of the Laplacian)."""
+  top, right, bottom, left = location
+  face = frame[max(top, 0):bottom, max(left, 0):right]
+  if face.size == 0:
+    return 0.0
+  gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+  sharpness = cv2.Laplacian(gray, cv2.CV_64F).var()
+  return float(sharpness * face.shape[0] * face.shape[1])
+
+
 # *============ FACE PAGE =================* 
 class FacePage(ttk.Frame):
   def __init__(self, controller):
@@ -56,12 +69,14 @@ class FacePage(ttk.Frame):
     self.faceButton = ttk.Button(self.content, image=controller.photoFace, command=self.startFaceRecognition)
     self.faceButton.pack(anchor="center", pady=5)
 
-    self.cap = None
+    self.camera = controller.camera
+    self.detector = None
     self.preview_job = None
-    self.process_idx = 0
-    self.process_idx_last_face_seen = 0
+    self.last_detection_seq = 0
+    self.last_face_seen = 0.0
+    self.overlay = None
     self.countdown = COUNTDOWN_START
-    self.prev_face_count = 0
+    self.candidate_frames = []
 
     self.exitBut = ttk.Button(self, text="EXIT", command=self.closeWin)
     self.exitBut.place(relx=1.0, rely=1.0, x=-5, y=-5, anchor="se")
@@ -76,11 +91,15 @@ class FacePage(ttk.Frame):
     self.statusLabel.config(text="Starting camera...")
     self.faceButton.configure(state="disabled")
     self.countdown = COUNTDOWN_START
-    self.process_idx = 0
-    self.cap = cv2.VideoCapture(0)
-    if not self.cap.isOpened():
-      self._handle_error("Camera not available")
-      return
+    self.candidate_frames = []
+    self.last_detection_seq = 0
+    self.last_face_seen = time.monotonic()
+    self.overlay = None
+
+    #Capture and detection run on their own threads; Tk only draws
+    self.camera.start()
+    self.detector = DetectionWorker(self.camera.frames, transform=resize_with_pad)
+    self.detector.start()
     self.statusLabel.config(text="Look at the camera")
     self._schedule_frame()
 
@@ -89,88 +108,88 @@ class FacePage(ttk.Frame):
     self.controller.destroy()
 
   def _schedule_frame(self):
-    self.preview_job = self.after(10, self._update_frame)
+    self.preview_job = self.after(PREVIEW_INTERVAL_MS, self._update_frame)
 
   def _update_frame(self):
-    if (self.process_idx - self.process_idx_last_face_seen) > MAX_PROCESS_TIME:
+    if self.camera.error:
+      self._stop_camera()
+      self._handle_error(self.camera.error)
+      return
+
+    if time.monotonic() - self.last_face_seen > NO_FACE_TIMEOUT:
       self._stop_camera()
       self._hide_camera()
       self.statusLabel.config(text="")
       self.faceButton.configure(state="normal")
       return
 
-    ret, frame = self.cap.read()
-    if not ret:
-      self._handle_error("Unable to read from camera")
-      return
+    detection = self.detector.latest()
+    if detection is not None and detection.seq > self.last_detection_seq:
+      self.last_detection_seq = detection.seq
+      if self._handle_detection(detection):
+        return
 
-    frame = cv2.rotate(frame, cv2.ROTATE_90_COUNTERCLOCKWISE)
-    frame = resize_with_pad(frame)
-    overlay_frame = frame.copy()
+    frame = self.camera.latest()
+    if frame is not None:
+      self._show_frame(resize_with_pad(frame))
 
-    if (self.process_idx % PROCESS_PERIOD) == 0:
-      rgb_small = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-      face_locations = face_recognition.face_locations(rgb_small)
-      frame_valid = len(face_locations) == 1
-
-      if frame_valid:
-        self.countdown -= 1
-        y1, x2, y2, x1 = face_locations[0]
-        cv2.rectangle(overlay_frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-        cv2.putText(
-          overlay_frame,
-          f"Confirming... {self.countdown}",
-          (10, 20),
-          FONT,
-          1.0,
-          (0, 255, 0),
-          1,
-        )
-        self.process_idx_last_face_seen = self.process_idx
-        if self.countdown <= 0:
-          self._submit_snapshot(frame)
-          return
-      else:
-        self.countdown = COUNTDOWN_START
-        if len(face_locations) == 0:
-          msg = "No face detected"
-        elif len(face_locations) > 1:
-          msg = "Only one person please"
-        else:
-          msg = "Hold still"
-        cv2.putText(
-          overlay_frame,
-          msg,
-          (10, 20),
-          FONT,
-          1.0,
-          (0, 0, 255),
-          1,
-        )
-
-      rgb_frame = cv2.cvtColor(overlay_frame, cv2.COLOR_BGR2RGB)
-      image = Image.fromarray(rgb_frame)
-      imgtk = ImageTk.PhotoImage(image=image)
-      self.video_label.configure(image=imgtk)
-      self.video_label.image = imgtk
-
-    self.process_idx += 1
     self._schedule_frame()
 
-  def _submit_snapshot(self, frame):
+  def _handle_detection(self, detection) -> bool:
+    """Advance the countdown on a new detection; True once the snapshot is submitted."""
+    face_locations = detection.locations
+    if len(face_locations) == 1:
+      self.countdown -= 1
+      self.candidate_frames.append((frame_quality(detection.frame, face_locations[0]), detection.frame))
+      self.overlay = (face_locations[0], f"Confirming... {self.countdown}", (0, 255, 0))
+      self.last_face_seen = time.monotonic()
+      if self.countdown <= 0:
+        self._submit_snapshot()
+        return True
+    else:
+      self.countdown = COUNTDOWN_START
+      self.candidate_frames = []
+      if len(face_locations) == 0:
+        msg = "No face detected"
+      else:
+        msg = "Only one person please"
+      self.overlay = (None, msg, (0, 0, 255))
+    return False
+
+  def _show_frame(self, frame):
+    overlay_frame = frame.copy()
+    if self.overlay is not None:
+      location, msg, color = self.overlay
+      if location is not None:
+        y1, x2, y2, x1 = location
+        cv2.rectangle(overlay_frame, (x1, y1), (x2, y2), color, 2)
+      cv2.putText(overlay_frame, msg, (10, 20), FONT, 1.0, color, 1)
+
+    rgb_frame = cv2.cvtColor(overlay_frame, cv2.COLOR_BGR2RGB)
+    image = Image.fromarray(rgb_frame)
+    imgtk = ImageTk.PhotoImage(image=image)
+    self.video_label.configure(image=imgtk)
+    self.video_label.image = imgtk
+
+  def _submit_snapshot(self):
     self._stop_camera()
     self.statusLabel.config(text="Recognizing...")
 
-    success, buffer = cv2.imencode(".jpg", frame)
-    if not success:
+    best = sorted(self.candidate_frames, key=lambda entry: entry[0], reverse=True)
+    frames = []
+    for _, frame in best[:BATCH_FRAMES]:
+      success, buffer = cv2.imencode(".jpg", frame)
+      if success:
+        frames.append(buffer.tobytes())
+    self.candidate_frames = []
+    if not frames:
       self._handle_error("Failed to capture photo")
       return
-    photo_bytes = buffer.tobytes()
-    threading.Thread(target=self._recognize_worker, args=(photo_bytes,), daemon=True).start()
+    threading.Thread(target=self._recognize_worker, args=(frames,), daemon=True).start()
 
-  def _recognize_worker(self, photo_bytes: bytes):
+  def _recognize_worker(self, frames):
     try:
-      result = self.controller.api.perform_face_recognition(photo_bytes)
+      result = self.controller.api.perform_batch_face_recognition(frames)
       user = result.get("user")
       if not user:
         raise APIError("No user returned from server")
@@ -201,9 +220,10 @@ class FacePage(ttk.Frame):
     if self.preview_job is not None:
       self.after_cancel(self.preview_job)
       self.preview_job = None
-    if self.cap is not None:
-      self.cap.release()
-      self.cap = None
+    #The shared camera stays warm for the next pages and idles out by itself
+    if self.detector is not None:
+      self.detector.stop()
+      self.detector = None
 
   def _hide_camera(self):
     self.video_label.configure(image=None)
@@ -6,6 +6,7 @@ import ttkbootstrap as ttk
 from PIL import Image, ImageTk
 
 from api import DormmonAPI, APIError
+from capture import CameraService
 from pages.face import FacePage
 from pages.home import HomePage
 from pages.balance import BalancePage
@@ -33,6 +34,7 @@ class UI(ttk.Window):
     self.current_user_info = None
 
     self.api = DormmonAPI()
+    self.camera = CameraService()
     self.users = []
     self.users_by_id = {}
     self.categories = []
@@ -149,6 +151,8 @@ class UI(ttk.Window):
     self.current_user = user_info["name"]
     self.current_user_id = user_info["id"]
     self.current_user_info = user_info
+    #Keep the camera warm for the photo pages
+    self.camera.start()
 
   def clear_current_user(self):
     self.current_user = None
@@ -156,23 +160,15 @@ class UI(ttk.Window):
     self.current_user_info = None
 
   def capture_snapshot(self):
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-      raise RuntimeError("Camera is not available")
-    try:
-      # Read a few frames, sometimes the webcam doesn't adjust in time.
-      for _ in range(15):
-        ret, frame = cap.read()
-        if not ret:
-          raise RuntimeError("Unable to read from camera")
-
-      frame = cv2.rotate(frame, cv2.ROTATE_90_COUNTERCLOCKWISE)
-      success, buffer = cv2.imencode(".jpg", frame)
-      if not success:
-        raise RuntimeError("Unable to encode captured frame")
-      return buffer.tobytes()
-    finally:
-      cap.release()
+    frame = self.camera.snapshot()
+    success, buffer = cv2.imencode(".jpg", frame)
+    if not success:
+      raise RuntimeError("Unable to encode captured frame")
+    return buffer.tobytes()
+
+  def destroy(self):
+    self.camera.stop()
+    super().destroy()
 
 
 if __name__ == '__main__':
@@ -1,5 +1,6 @@
 import os
 
+import click
 from flask import Flask, render_template, send_from_directory
 
 import category
@@ -9,7 +10,11 @@ import ledger
 import user
 import tasks
 import recognition
+from face_encoding import set_storage_dtype
+from database import DEFAULT_PRAGMAS
 from database_access import (
+    database_configure,
+    database_connect_requests,
     database_init,
 )
 #hola
@@ -17,7 +22,41 @@ app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config["TEMPLATES_AUTO_RELOAD"] = True
+app.config['FACE_TOLERANCE'] = float(os.environ.get('DORMMON_FACE_TOLERANCE', 0.6))
+app.config['FACE_KNN'] = int(os.environ.get('DORMMON_FACE_KNN', 3))
+# Share of usable frames that must agree in /face/recognize/batch
+app.config['FACE_MIN_AGREEMENT'] = float(os.environ.get('DORMMON_FACE_MIN_AGREEMENT', 0.5))
+# Galleries above this many samples are searched through an IVF index
+app.config['FACE_INDEX_THRESHOLD'] = int(os.environ.get('DORMMON_FACE_INDEX_THRESHOLD', 5000))
+app.config['FACE_INDEX_NPROBE'] = int(os.environ.get('DORMMON_FACE_INDEX_NPROBE', 8))
+# Recognition pipeline: lower working size and "hog" for Raspberry-class servers
+app.config['FACE_WORKING_SIZE'] = int(os.environ.get('DORMMON_FACE_WORKING_SIZE', 640))
+app.config['FACE_DETECTOR_MODEL'] = os.environ.get('DORMMON_FACE_DETECTOR_MODEL', 'hog')
+app.config['FACE_UPSAMPLE'] = int(os.environ.get('DORMMON_FACE_UPSAMPLE', 1))
+app.config['FACE_JITTERS'] = int(os.environ.get('DORMMON_FACE_JITTERS', 1))
+# Recognition worker processes and how long a request waits on them (seconds)
+app.config['FACE_WORKERS'] = int(os.environ.get('DORMMON_FACE_WORKERS', os.cpu_count() or 1))
+app.config['FACE_TIMEOUT'] = float(os.environ.get('DORMMON_FACE_TIMEOUT', 10))
+# Separate worker processes for enrollment, so it never delays logins
+app.config['FACE_ENROLL_WORKERS'] = int(os.environ.get('DORMMON_FACE_ENROLL_WORKERS', os.cpu_count() or 1))
+# Recognition results cached by upload digest (entries, seconds)
+app.config['FACE_CACHE_SIZE'] = int(os.environ.get('DORMMON_FACE_CACHE_SIZE', 256))
+app.config['FACE_CACHE_TTL'] = float(os.environ.get('DORMMON_FACE_CACHE_TTL', 300))
+# Precision of stored face encodings: "float32" or the more compact "float16"
+app.config['FACE_STORAGE_DTYPE'] = os.environ.get('DORMMON_FACE_STORAGE_DTYPE', 'float32')
+# SQLite connection pragmas, see database.DEFAULT_PRAGMAS
+app.config['DATABASE_PATH'] = os.environ.get('DORMMON_DATABASE_PATH', 'my_database.db')
+app.config['DATABASE_PRAGMAS'] = {
+    'journal_mode': os.environ.get('DORMMON_DB_JOURNAL_MODE', DEFAULT_PRAGMAS['journal_mode']),
+    'busy_timeout': int(os.environ.get('DORMMON_DB_BUSY_TIMEOUT', DEFAULT_PRAGMAS['busy_timeout'])),
+    'synchronous': os.environ.get('DORMMON_DB_SYNCHRONOUS', DEFAULT_PRAGMAS['synchronous']),
+    'mmap_size': int(os.environ.get('DORMMON_DB_MMAP_SIZE', DEFAULT_PRAGMAS['mmap_size'])),
+    'cache_size': int(os.environ.get('DORMMON_DB_CACHE_SIZE', DEFAULT_PRAGMAS['cache_size'])),
+}
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+set_storage_dtype(app.config['FACE_STORAGE_DTYPE'])
+database_configure(app.config['DATABASE_PATH'], app.config['DATABASE_PRAGMAS'])
+database_connect_requests(app)
 
 # Initialize database on startup
 print("Initializing database...")
@@ -32,6 +71,61 @@ def index():
 def download_file(name):
     return send_from_directory(app.config["UPLOAD_FOLDER"], name)
 
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    """Fail if a hot query falls back to a full table scan."""
+    from query_checks import check_query_plans
+
+    failed = False
+    for name, lines in check_query_plans().items():
+        click.echo(name)
+        for line in lines:
+            click.echo(f"  {line}")
+        failed = failed or any(line.startswith("!") for line in lines)
+    if failed:
+        raise click.ClickException("Full table scans found (marked with !)")
+
+@app.cli.command("check-query-counts")
+def check_query_counts_command():
+    """Fail if the event listing issues more queries for larger pages."""
+    from query_checks import event_listing_query_counts
+
+    counts = event_listing_query_counts()
+    for limit, count in counts.items():
+        click.echo(f"limit={limit}: {count} queries")
+    if len(set(counts.values())) > 1:
+        raise click.ClickException("Event listing query count grows with the limit")
+
+@app.cli.command("check-concurrent-writes")
+def check_concurrent_writes_command():
+    """Fail if concurrent writers hit "database is locked" on a scratch database."""
+    from query_checks import concurrent_write_failures
+
+    failures = concurrent_write_failures(app.config['DATABASE_PRAGMAS'])
+    for name, count in failures.items():
+        click.echo(f"{name}: {count} failed")
+    if any(failures.values()):
+        raise click.ClickException("Writers failed on the database lock")
+
+@app.cli.command("rebuild-balances")
+def rebuild_balances_command():
+    """Recompute the stored user balances from the ledger."""
+    from database_access import ledger_rebuild_balances
+
+    click.echo(f"Rebuilt balances of {ledger_rebuild_balances()} users")
+
+@app.cli.command("check-balances")
+def check_balances_command():
+    """Fail if a stored balance disagrees with the ledger."""
+    from database_access import ledger_check_balances
+
+    mismatches = ledger_check_balances()
+    for user_id, (stored, computed) in sorted(mismatches.items()):
+        click.echo(f"user {user_id}: stored {stored}, ledger {computed}")
+    if mismatches:
+        raise click.ClickException("Balances out of sync, run `flask rebuild-balances`")
+    click.echo("Balances match the ledger")
+
 user.routes(app)
 category.routes(app)
 event.routes(app)
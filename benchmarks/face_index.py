@@ -0,0 +1,75 @@
+"""
+Query time of the IVF index against brute-force matching by gallery size.
+
+Run from the repository root:
+
+    python -m benchmarks.face_index
+    python -m benchmarks.face_index --sizes 10000,100000,500000 --nprobe 4,8,16
+
+For each gallery size it reports p50/p95 query latency of the exact matcher
+and of the indexed matcher, the index build and single-user insert times,
+and recall: how often the indexed matcher picks the same user as the exact one.
+"""
+import argparse
+
+import numpy as np
+
+from benchmarks.recognition import (
+    SAMPLES_PER_USER,
+    percentiles,
+    synthetic_gallery,
+    timed,
+)
+from gallery import ENCODING_DIM
+from matcher import FaceMatcher
+
+DEFAULT_SIZES = (1000, 10000, 50000, 100000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--nprobe", default="8", help="Comma separated nprobe values")
+    parser.add_argument("--probes", type=int, default=50)
+    parser.add_argument("--knn", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    nprobes = [int(value) for value in args.nprobe.split(",") if value]
+
+    header = f"{'size':>8}{'method':>12}{'build_ms':>12}{'insert_ms':>12}{'p50':>10}{'p95':>10}{'recall':>9}"
+    print("Query latency in ms")
+    print(header)
+    for size in (int(value) for value in args.sizes.split(",") if value):
+        encodings, labels, centres = synthetic_gallery(size, rng)
+        exact = FaceMatcher(encodings, labels, k=args.knn)
+        picks = rng.integers(0, centres.shape[0], args.probes)
+        queries = centres[picks] + rng.normal(0.0, 0.03, (args.probes, ENCODING_DIM))
+
+        exact_winners = [exact.match(query).index for query in queries]
+        exact_times = []
+        for query in queries:
+            exact_times += timed(lambda: exact.match(query), 1)
+        stats = percentiles(exact_times)
+        print(f"{size:>8}{'exact':>12}{'-':>12}{'-':>12}{stats['p50']:>10.3f}{stats['p95']:>10.3f}{1.0:>9.3f}")
+
+        new_user = centres[0] + rng.normal(0.0, 0.03, (SAMPLES_PER_USER, ENCODING_DIM))
+        for nprobe in nprobes:
+            build = timed(lambda: exact.with_index(nprobe), 1)[0]
+            indexed = exact.with_index(nprobe)
+            insert = timed(lambda: indexed.with_added(new_user, int(labels.max()) + 1), 1)[0]
+            times = []
+            hits = 0
+            for query, expected in zip(queries, exact_winners):
+                times += timed(lambda: indexed.match(query), 1)
+                hits += indexed.match(query).index == expected
+            stats = percentiles(times)
+            print(
+                f"{size:>8}{f'ivf/{nprobe}':>12}{build:>12.1f}{insert:>12.1f}"
+                f"{stats['p50']:>10.3f}{stats['p95']:>10.3f}{hits / len(queries):>9.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
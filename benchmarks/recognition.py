@@ -0,0 +1,182 @@
+"""
+Face recognition benchmark over synthetic galleries.
+
+Replays a fixed set of probe images through the recognition stages (decode,
+detect, encode) and a fixed set of probe encodings through the matcher for
+each gallery size, then reports p50/p95 latency per stage.
+
+Run from the repository root:
+
+    python -m benchmarks.recognition
+    python -m benchmarks.recognition --stub-detector --sizes 10,1000,100000
+    python -m benchmarks.recognition --images database/maia
+
+--stub-detector replaces dlib detection and encoding with a fixed centre box
+and a pixel-derived pseudo encoding, so the suite runs offline on CPU without
+face_recognition installed. Use it to catch decode and matcher regressions.
+"""
+import argparse
+import io
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+from PIL import Image
+
+from face_pipeline import (
+    PipelineSettings,
+    encode_faces,
+    load_image_scaled,
+    locate_faces,
+)
+from gallery import ENCODING_DIM
+from matcher import FaceMatcher
+
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+SAMPLES_PER_USER = 5
+
+
+def synthetic_gallery(size: int, rng: np.random.Generator):
+    """
+    Build `size` encodings grouped SAMPLES_PER_USER to a user.
+
+    Centres and spread roughly follow dlib embeddings: components around
+    +-0.1 and about 0.3-0.4 between samples of the same person.
+    """
+    num_users = max(1, size // SAMPLES_PER_USER)
+    centres = rng.normal(0.0, 0.09, (num_users, ENCODING_DIM))
+    labels = np.arange(size) % num_users
+    encodings = centres[labels] + rng.normal(0.0, 0.03, (size, ENCODING_DIM))
+    return encodings.astype(np.float32), labels, centres
+
+
+def synthetic_probe_images(count: int, rng: np.random.Generator) -> List[bytes]:
+    """Deterministic 1280x960 JPEGs standing in for kiosk snapshots."""
+    images = []
+    for _ in range(count):
+        pixels = rng.integers(0, 256, (960, 1280, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, "JPEG", quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+
+def load_probe_images(directory: str) -> List[bytes]:
+    return [path.read_bytes() for path in sorted(Path(directory).iterdir()) if path.is_file()]
+
+
+def stub_locate(image: np.ndarray, settings: PipelineSettings) -> List[tuple]:
+    height, width = image.shape[:2]
+    return [(height // 4, 3 * width // 4, 3 * height // 4, width // 4)]
+
+
+def stub_encode(image: np.ndarray, locations: List[tuple], settings: PipelineSettings):
+    encodings = []
+    for top, right, bottom, left in locations:
+        face = image[top:bottom, left:right].astype(np.float32)
+        seed = int(face.sum()) % (2**32)
+        encodings.append(np.random.default_rng(seed).normal(0.0, 0.09, ENCODING_DIM))
+    return encodings
+
+
+def timed(fn: Callable, repeat: int) -> List[float]:
+    """Run fn `repeat` times and return per-call latencies in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return samples
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    return {
+        "p50": float(np.percentile(samples, 50)),
+        "p95": float(np.percentile(samples, 95)),
+    }
+
+
+def bench_image_stages(images: List[bytes], settings: PipelineSettings, repeat: int, stub: bool):
+    locate = stub_locate if stub else locate_faces
+    encode = stub_encode if stub else encode_faces
+    stages: Dict[str, List[float]] = {"decode": [], "detect": [], "encode": []}
+
+    for data in images:
+        image, _ = load_image_scaled(io.BytesIO(data), settings.max_side)
+        locations = locate(image, settings)
+        stages["decode"] += timed(
+            lambda: load_image_scaled(io.BytesIO(data), settings.max_side), repeat
+        )
+        stages["detect"] += timed(lambda: locate(image, settings), repeat)
+        if locations:
+            stages["encode"] += timed(lambda: encode(image, locations, settings), repeat)
+
+    return {stage: percentiles(samples) for stage, samples in stages.items() if samples}
+
+
+def bench_match(sizes, probes: int, repeat: int, k: int, rng: np.random.Generator):
+    results = {}
+    for size in sizes:
+        encodings, labels, centres = synthetic_gallery(size, rng)
+        build = timed(lambda: FaceMatcher(encodings, labels, k=k), 1)
+        matcher = FaceMatcher(encodings, labels, k=k)
+        picks = rng.integers(0, centres.shape[0], probes)
+        queries = centres[picks] + rng.normal(0.0, 0.03, (probes, ENCODING_DIM))
+        samples = []
+        for query in queries:
+            samples += timed(lambda: matcher.match(query), repeat)
+        results[size] = {"build_ms": build[0], **percentiles(samples)}
+    return results
+
+
+def print_table(title: str, rows: Dict, columns: List[str]):
+    print(f"\n{title}")
+    print(f"{'':>12}" + "".join(f"{column:>12}" for column in columns))
+    for name, values in rows.items():
+        print(f"{name!s:>12}" + "".join(f"{values[column]:>12.3f}" for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="Comma separated gallery sizes (encodings)")
+    parser.add_argument("--probes", type=int, default=20, help="Probe encodings per size")
+    parser.add_argument("--images", help="Directory of probe images (default: synthetic)")
+    parser.add_argument("--num-images", type=int, default=5, help="Synthetic probe images")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per probe")
+    parser.add_argument("--working-size", type=int, default=640)
+    parser.add_argument("--model", default="hog", choices=("hog", "cnn"))
+    parser.add_argument("--upsample", type=int, default=1)
+    parser.add_argument("--jitters", type=int, default=1)
+    parser.add_argument("--knn", type=int, default=3)
+    parser.add_argument("--stub-detector", action="store_true",
+                        help="Replace dlib detection/encoding with a CPU stub")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    settings = PipelineSettings(args.working_size, args.model, args.upsample, args.jitters)
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    images = (
+        load_probe_images(args.images)
+        if args.images
+        else synthetic_probe_images(args.num_images, rng)
+    )
+
+    detector = "stub" if args.stub_detector else args.model
+    print(f"{len(images)} probe images, detector={detector}, working size={args.working_size}")
+    print_table(
+        "Image stages (ms)",
+        bench_image_stages(images, settings, args.repeat, args.stub_detector),
+        ["p50", "p95"],
+    )
+    print_table(
+        "Match stage by gallery size (ms)",
+        bench_match(sizes, args.probes, args.repeat, args.knn, rng),
+        ["build_ms", "p50", "p95"],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,17 @@ from peewee import (
     TextField,
 )
 
-db = SqliteDatabase('my_database.db')
+# WAL lets readers proceed while a write is in progress; NORMAL sync is safe
+# under WAL and avoids an fsync per transaction. See database_configure().
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'wal',
+    'busy_timeout': 5000,  # ms a writer waits for the lock before failing
+    'synchronous': 'normal',
+    'mmap_size': 64 * 1024 * 1024,
+    'cache_size': -16000,  # Negative means KiB, i.e. ~16 MB of page cache
+}
+
+db = SqliteDatabase('my_database.db', pragmas=DEFAULT_PRAGMAS)
 
 class BaseModel(Model):
     class Meta:
@@ -20,6 +30,7 @@ class BaseModel(Model):
 class User(BaseModel):
     name = CharField(unique=True)
     face_encoding = BlobField()
+    face_samples = BlobField(null=True)  # Every enrollment encoding, packed
     created_at = DateTimeField(default=datetime.datetime.now)
    
 class Item(BaseModel):
@@ -32,6 +43,11 @@ class ItemStock(BaseModel):
     stock = IntegerField()
     logged_at = DateTimeField(default=datetime.datetime.now)
 
+    class Meta:
+        indexes = (
+            (('item', 'logged_at'), False), # Latest stock per item
+        )
+
 class EventCategory(BaseModel):
     name = CharField(unique=True)
     icon = CharField()
@@ -46,6 +62,13 @@ class Event(BaseModel):
     stock = ForeignKeyField(ItemStock, backref='event', null=True, unique=True, on_delete='CASCADE')
     notes = TextField(default="") 
 
+    class Meta:
+        indexes = (
+            (('logged_at',), False), # Recent events
+            (('category', 'logged_at'), False), # Recent/latest events of a category
+            (('user', 'category', 'logged_at'), False), # Has the user logged a category since
+        )
+
 class Ledger(Model):
     event = ForeignKeyField(Event, backref='ledger_items', null=True, on_delete='CASCADE')
     payer = ForeignKeyField(User, backref='money_sent', on_delete='CASCADE')
@@ -57,4 +80,13 @@ class Ledger(Model):
         database = db
         indexes = (
             (('event', 'payer', 'beneficiary'), False), # False = not unique
+            # Cover the balance sums, so they never touch the table rows
+            (('payer', 'amount'), False),
+            (('beneficiary', 'amount'), False),
         )
+
+
+class UserBalance(BaseModel):
+    """Net ledger balance per user, kept in step with the Ledger by ledger_add."""
+    user = ForeignKeyField(User, primary_key=True, backref='balance', on_delete='CASCADE')
+    balance = IntegerField(default=0)
@@ -1,42 +1,126 @@
 """Database access layer - all database queries and operations."""
 
+import base64
+import hashlib
 from datetime import datetime
 from pathlib import Path
 from typing import List, Optional
 
-from peewee import fn
-
-from database import Event, EventCategory, Item, ItemStock, Ledger, User, db
+from peewee import JOIN, Tuple, chunked, fn, prefetch
+from playhouse.migrate import SqliteMigrator, migrate
+
+from database import (
+    Event,
+    EventCategory,
+    Item,
+    ItemStock,
+    Ledger,
+    User,
+    UserBalance,
+    db,
+)
+
+
+def _add_missing_columns(model, *fields):
+    """Add columns introduced after a table was first created."""
+    existing = {column.name for column in db.get_columns(model._meta.table_name)}
+    migrator = SqliteMigrator(db)
+    operations = [
+        migrator.add_column(model._meta.table_name, field.column_name, field)
+        for field in fields
+        if field.column_name not in existing
+    ]
+    if operations:
+        migrate(*operations)
+
+
+def _migrate_face_blobs():
+    """Rewrite legacy float64 encoding blobs in the versioned format, once."""
+    from face_encoding import is_legacy_blob, pack_encodings, unpack_encodings
+
+    rows = User.select(User.id, User.face_encoding, User.face_samples).tuples()
+    updates = []
+    for user_id, face_encoding, face_samples in rows:
+        legacy_encoding = face_encoding and is_legacy_blob(face_encoding)
+        legacy_samples = face_samples and is_legacy_blob(face_samples)
+        if legacy_encoding or legacy_samples:
+            updates.append((
+                user_id,
+                pack_encodings(unpack_encodings(face_encoding)) if legacy_encoding else face_encoding,
+                pack_encodings(unpack_encodings(face_samples)) if legacy_samples else face_samples,
+            ))
+    if not updates:
+        return
+    with db.atomic():
+        for user_id, face_encoding, face_samples in updates:
+            User.update(face_encoding=face_encoding, face_samples=face_samples).where(
+                User.id == user_id
+            ).execute()
+    print(f"Migrated face encodings of {len(updates)} users")
+
+
+def database_configure(path: str, pragmas: dict):
+    """Point the database at `path` with the given per-connection pragmas."""
+    busy_timeout = pragmas.get("busy_timeout", 5000)
+    db.init(path, pragmas=pragmas, timeout=busy_timeout / 1000)
+
+
+def database_connect_requests(app):
+    """Open one connection per request and close it when the request ends."""
+
+    @app.before_request
+    def _db_connect():
+        db.connect(reuse_if_open=True)
+
+    @app.teardown_request
+    def _db_close(exc):
+        if not db.is_closed():
+            db.close()
 
 
 def database_init():
     """Initialize database and create default category."""
     db.connect()
-    db.create_tables([User, Item, ItemStock, EventCategory, Event, Ledger])
+    db.create_tables([User, Item, ItemStock, EventCategory, Event, Ledger, UserBalance])
+    _add_missing_columns(User, User.face_samples)
+    # Fill the balance table the first time it exists next to a populated ledger
+    if not UserBalance.select().exists() and Ledger.select().exists():
+        ledger_rebuild_balances()
+    _migrate_face_blobs()
 
     def load_face_encs(dir_path):
+        from encoding_cache import encode_face_from_bytes_cached
         from face_encoding import (
             average_encodings,
-            encode_face_from_image,
             encode_face_to_bytes,
+            encode_samples_to_bytes,
         )
         dir_path = Path(dir_path)
         paths = [subp for subp in dir_path.iterdir()]
-        encs = [encode_face_from_image(p) for p in paths]
-        encs = average_encodings(encs)
-        encs_bytes = encode_face_to_bytes(encs)
-        return encs_bytes
+        # Unchanged photos are read back from the encoding cache, not re-encoded
+        encs = [encode_face_from_bytes_cached(p.read_bytes()) for p in paths]
+        encs = [enc for enc in encs if enc is not None]
+        avg_bytes = encode_face_to_bytes(average_encodings(encs))
+        return avg_bytes, encode_samples_to_bytes(encs)
 
     def create_user_if_not_exist(name, path):
         user = User.get_or_none(User.name == name)
         if user:
-            print(f"User {name} exists")
+            # Users created before per-sample storage only have the average
+            if user.face_samples is None and Path(path).is_dir():
+                user.face_encoding, user.face_samples = load_face_encs(path)
+                user.save()
+                print(f"User {name} exists, stored face samples")
+            else:
+                print(f"User {name} exists")
             return user
         else:
+            face_encoding, face_samples = load_face_encs(path)
             user, _ = User.get_or_create(
                 name=name,
                 defaults={
-                    "face_encoding": load_face_encs(path),
+                    "face_encoding": face_encoding,
+                    "face_samples": face_samples,
                     "created_at": datetime.now(),
                 },
             )
@@ -90,10 +174,18 @@ def user_get_by_id(user_id: int) -> User:
     return User.get_by_id(user_id)
 
 
-def user_add(name: str, face_encoding: bytes) -> User:
-    """Create a new user."""
+def user_add(
+    name: str, face_encoding: bytes, face_samples: Optional[bytes] = None
+) -> User:
+    """
+    Create a new user. Callers register them in the recognition gallery with
+    face_gallery.add_user() once the surrounding transaction has committed.
+    """
     return User.create(
-        name=name, face_encoding=face_encoding, created_at=datetime.now()
+        name=name,
+        face_encoding=face_encoding,
+        face_samples=face_samples,
+        created_at=datetime.now(),
     )
 
 
@@ -102,6 +194,16 @@ def user_exists(name: str) -> bool:
     return User.select().where(User.name == name).exists()
 
 
+def user_add_if_not_exists(
+    name: str, face_encoding: bytes, face_samples: Optional[bytes] = None
+) -> Optional[User]:
+    """Create a new user unless the name is taken, in which case return None."""
+    with db.atomic('IMMEDIATE'):
+        if user_exists(name):
+            return None
+        return user_add(name, face_encoding, face_samples)
+
+
 # Event Category operations
 def category_get_all():
     """Get all event categories."""
@@ -129,24 +231,71 @@ def category_get_by_name(name: str) -> Optional[EventCategory]:
 
 
 # Event operations
-def event_get_recent(
+def event_cursor(event: Event) -> str:
+    """Opaque pagination cursor marking an event's (logged_at, id) position."""
+    raw = f"{event.logged_at.isoformat()}|{event.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _parse_event_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        logged_at, event_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(logged_at), int(event_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def event_get_recent_with_details(
     limit: int = 50,
     category_id: Optional[int] = None,
     category_name: Optional[str] = None,
-):
-    """Get recent events, optionally filtered by category."""
-    query = Event.select().order_by(Event.logged_at.desc())
-
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+) -> List[tuple]:
+    """
+    Recent events with their cost as (event, cost) pairs, newest first, in two
+    queries. `before`/`after` are event_cursor() values to page from.
+    """
+    Payer = User.alias()
+    Beneficiary = User.alias()
+    position = Tuple(Event.logged_at, Event.id)
+    events = (
+        Event.select(Event, User, EventCategory, ItemStock, Item)
+        .join(User)
+        .switch(Event)
+        .join(EventCategory)
+        .switch(Event)
+        .join(ItemStock, JOIN.LEFT_OUTER)
+        .join(Item, JOIN.LEFT_OUTER)
+    )
     if category_id is not None:
-        query = query.where(Event.category == category_id)
+        events = events.where(Event.category == category_id)
     elif category_name:
-        query = (
-            query.join(EventCategory)
-            .where(EventCategory.name == category_name)
-            .switch(Event)
-        )
+        events = events.where(EventCategory.name == category_name)
+    if after:
+        events = events.where(position > Tuple(*_parse_event_cursor(after)))
+        events = events.order_by(Event.logged_at.asc(), Event.id.asc())
+    else:
+        if before:
+            events = events.where(position < Tuple(*_parse_event_cursor(before)))
+        events = events.order_by(Event.logged_at.desc(), Event.id.desc())
+    ledger_items = (
+        Ledger.select(Ledger, Payer, Beneficiary)
+        .join(Payer, on=(Ledger.payer == Payer.id))
+        .switch(Ledger)
+        .join(Beneficiary, on=(Ledger.beneficiary == Beneficiary.id))
+        .order_by(Ledger.id)
+    )
+
+    result = []
+    for event in prefetch(events.limit(limit), ledger_items):
+        cost = sum(item.amount or 0 for item in event.ledger_items)
+        result.append((event, cost or None))
+    if after:
+        result.reverse()
+    return result
 
-    return query.limit(limit)
 
 def event_get_by_id(id: int) -> Event:
     return Event.get_by_id(id)
@@ -158,6 +307,7 @@ def event_add(
     photo_path: str,
     notes: str = "",
     item_stock_id: Optional[int] = None,
+    logged_at: Optional[datetime] = None,
 ) -> Event:
     """Create a new event."""
     return Event.create(
@@ -166,11 +316,83 @@ def event_add(
         photo_path=photo_path,
         notes=notes,
         stock=item_stock_id,
-        logged_at=datetime.now(),
+        logged_at=logged_at or datetime.now(),
         modified_at=datetime.now(),
     )
 
 
+def _split_cost(payer_id: int, cost: Optional[int], sharer_ids) -> List[tuple]:
+    """
+    (payer_id, beneficiary_id, amount) rows sharing a cost equally.
+    The payer always shares; no sharers means every user does.
+    """
+    if cost is None:
+        return []
+    if sharer_ids:
+        sharer_ids = list(sharer_ids)
+        if payer_id not in sharer_ids:
+            sharer_ids.append(payer_id)
+    else:
+        sharer_ids = [user_id for user_id, in User.select(User.id).tuples()]
+    amount_per_person = round(cost / len(sharer_ids))
+    return [(payer_id, sharer_id, amount_per_person) for sharer_id in sharer_ids]
+
+
+def event_create_many(events: List[dict]) -> List[Event]:
+    """
+    Create events with their stock readings and cost-sharing ledger rows in
+    one transaction: either every event is stored or none is.
+    """
+    created = []
+    ledger_rows = []
+    # IMMEDIATE: a deferred transaction that reads first cannot wait for the write lock
+    with db.atomic('IMMEDIATE'):
+        for spec in events:
+            payer = User.get_by_id(spec["user_id"])
+            EventCategory.get_by_id(spec["category_id"])
+
+            item_stock_id = None
+            if spec.get("item_id") is not None and spec.get("stock") is not None:
+                item = Item.get_by_id(spec["item_id"])
+                item_stock_id = ItemStock.create(item=item, stock=spec["stock"]).id
+
+            event = event_add(
+                user_id=payer.id,
+                category_id=spec["category_id"],
+                photo_path=spec["photo_path"],
+                notes=spec.get("notes", ""),
+                item_stock_id=item_stock_id,
+                logged_at=spec.get("logged_at"),
+            )
+            created.append(event)
+            ledger_rows += [
+                (event.id, *row)
+                for row in _split_cost(payer.id, spec.get("cost"), spec.get("sharer_ids"))
+            ]
+
+        now = datetime.now()
+        for batch in chunked(ledger_rows, 100):
+            Ledger.insert_many(
+                [
+                    {
+                        "event": event_id,
+                        "payer": payer_id,
+                        "beneficiary": beneficiary_id,
+                        "amount": amount,
+                        "created_at": now,
+                    }
+                    for event_id, payer_id, beneficiary_id, amount in batch
+                ]
+            ).execute()
+        _balance_apply(_ledger_deltas(row[1:] for row in ledger_rows))
+    return created
+
+
+def event_create(**spec) -> Event:
+    """Create one event atomically, see event_create_many()."""
+    return event_create_many([spec])[0]
+
+
 def event_get_latest_by_category(category: EventCategory) -> Optional[Event]:
     """Return the latest event for a category."""
     return (
@@ -196,34 +418,49 @@ def event_user_has_category_entry_since(
     )
 
 
-def event_get_cost(event_id: int) -> Optional[int]:
-    """Get the total cost of an event from ledger entries."""
-    # Sum all ledger entries for this event (each entry is a portion of the total)
-    # We can sum all entries or just the self-reference ones - both should give the same total
-    total = (
-        Ledger.select(fn.Sum(Ledger.amount))
-        .where(Ledger.event == event_id)
-        # .where(Ledger.payer == Ledger.beneficiary)  # Self-reference entries represent the total
-        .scalar()
-    )
-    return total if total else None
+# Ledger operations
+def _balance_apply(deltas: dict):
+    """Add {user_id: delta} to the stored balances; call inside a transaction."""
+    for user_id, delta in deltas.items():
+        if not delta:
+            continue
+        (
+            UserBalance.insert(user=user_id, balance=delta)
+            .on_conflict(
+                conflict_target=[UserBalance.user],
+                update={UserBalance.balance: UserBalance.balance + delta},
+            )
+            .execute()
+        )
+
+
+def _ledger_deltas(entries) -> dict:
+    """Balance change per user caused by (payer_id, beneficiary_id, amount) entries."""
+    deltas = {}
+    for payer_id, beneficiary_id, amount in entries:
+        amount = amount or 0
+        deltas[payer_id] = deltas.get(payer_id, 0) + amount
+        deltas[beneficiary_id] = deltas.get(beneficiary_id, 0) - amount
+    return deltas
 
 
-# Ledger operations
 def ledger_add(
     event_id: Optional[int],
     payer_id: int,
     beneficiary_id: int,
     amount: int,
 ) -> Ledger:
-    """Create a ledger entry."""
-    return Ledger.create(
-        event=event_id,
-        payer=payer_id,
-        beneficiary=beneficiary_id,
-        amount=amount,
-        created_at=datetime.now(),
-    )
+    """Create a ledger entry and update both users' balances atomically."""
+    with db.atomic():
+        entry = Ledger.create(
+            event=event_id,
+            payer=payer_id,
+            beneficiary=beneficiary_id,
+            amount=amount,
+            created_at=datetime.now(),
+        )
+        _balance_apply(_ledger_deltas([(payer_id, beneficiary_id, amount)]))
+    return entry
 
 
 def ledger_get_balance(user_id: int) -> int:
@@ -232,28 +469,139 @@ def ledger_get_balance(user_id: int) -> int:
     Positive = user is owed money (others owe them)
     Negative = user owes money (they owe others)
     """
-    money_sent = (
-        Ledger.select(fn.Sum(Ledger.amount)).where(Ledger.payer == user_id).scalar()
-        or 0
-    )
-    money_received = (
-        Ledger.select(fn.Sum(Ledger.amount))
-        .where(Ledger.beneficiary == user_id)
+    return (
+        UserBalance.select(UserBalance.balance)
+        .where(UserBalance.user == user_id)
         .scalar()
         or 0
     )
-    return money_sent - money_received
 
 
 def ledger_get_all_balances() -> dict:
     """Get balances for all users. Returns dict mapping user_id to balance."""
-    users = User.select()
+    return dict(UserBalance.select(UserBalance.user, UserBalance.balance).tuples())
+
+
+def ledger_compute_balances() -> dict:
+    """Recompute every balance from the Ledger itself (two grouped scans)."""
     balances = {}
-    for user in users:
-        balances[user.id] = ledger_get_balance(user.id)
+    sent = Ledger.select(Ledger.payer, fn.Sum(Ledger.amount)).group_by(Ledger.payer)
+    received = Ledger.select(Ledger.beneficiary, fn.Sum(Ledger.amount)).group_by(
+        Ledger.beneficiary
+    )
+    for user_id, total in sent.tuples():
+        balances[user_id] = balances.get(user_id, 0) + (total or 0)
+    for user_id, total in received.tuples():
+        balances[user_id] = balances.get(user_id, 0) - (total or 0)
     return balances
 
 
+def ledger_rebuild_balances() -> int:
+    """Replace the stored balances with ones recomputed from the Ledger."""
+    balances = ledger_compute_balances()
+    with db.atomic():
+        UserBalance.delete().execute()
+        UserBalance.insert_many(
+            [{"user": user_id, "balance": balance} for user_id, balance in balances.items()]
+        ).execute()
+    return len(balances)
+
+
+def ledger_check_balances() -> dict:
+    """Return {user_id: (stored, recomputed)} for every balance that disagrees."""
+    stored = ledger_get_all_balances()
+    computed = ledger_compute_balances()
+    return {
+        user_id: (stored.get(user_id, 0), computed.get(user_id, 0))
+        for user_id in stored.keys() | computed.keys()
+        if stored.get(user_id, 0) != computed.get(user_id, 0)
+    }
+
+
+def ledger_get_debt_matrix() -> dict:
+    """
+    Net pairwise debts from one grouped query over the Ledger.
+    Returns {(debtor_id, creditor_id): amount} with positive amounts only.
+    """
+    totals = (
+        Ledger.select(Ledger.payer, Ledger.beneficiary, fn.Sum(Ledger.amount))
+        .where(Ledger.payer != Ledger.beneficiary)
+        .group_by(Ledger.payer, Ledger.beneficiary)
+        .tuples()
+    )
+    # The beneficiary of an entry owes its payer
+    owed = {}
+    for payer_id, beneficiary_id, amount in totals:
+        owed[(beneficiary_id, payer_id)] = amount or 0
+    matrix = {}
+    for (debtor_id, creditor_id), amount in owed.items():
+        net = amount - owed.get((creditor_id, debtor_id), 0)
+        if net > 0:
+            matrix[(debtor_id, creditor_id)] = net
+    return matrix
+
+
+def ledger_get_net_positions() -> dict:
+    """
+    Collapse the debt matrix into one net amount per user, leaving out
+    settled users. Positive = user is owed money, negative = user owes.
+    """
+    net = {}
+    for (debtor_id, creditor_id), amount in ledger_get_debt_matrix().items():
+        net[debtor_id] = net.get(debtor_id, 0) - amount
+        net[creditor_id] = net.get(creditor_id, 0) + amount
+    return {user_id: amount for user_id, amount in net.items() if amount != 0}
+
+
+def ledger_get_settlement_plan() -> List[tuple]:
+    """
+    Transfers that settle every debt, as (debtor_id, creditor_id, amount):
+    the largest debtor repeatedly pays the largest creditor.
+    """
+    net = ledger_get_net_positions()
+    debtors = sorted(((-b, u) for u, b in net.items() if b < 0), reverse=True)
+    creditors = sorted(((b, u) for u, b in net.items() if b > 0), reverse=True)
+
+    plan = []
+    while debtors and creditors:
+        debt, debtor_id = debtors.pop(0)
+        credit, creditor_id = creditors.pop(0)
+        amount = min(debt, credit)
+        plan.append((debtor_id, creditor_id, amount))
+        if debt > amount:
+            debtors.append((debt - amount, debtor_id))
+            debtors.sort(reverse=True)
+        if credit > amount:
+            creditors.append((credit - amount, creditor_id))
+            creditors.sort(reverse=True)
+    return plan
+
+
+def ledger_settlement_plan_token(plan: List[tuple]) -> str:
+    """Short digest of a settlement plan, so a client can confirm what it saw."""
+    return hashlib.sha256(repr(sorted(plan)).encode()).hexdigest()[:16]
+
+
+def ledger_settle_all(plan_token: str) -> List[Ledger]:
+    """
+    Record the whole settlement plan as payments in one transaction.
+    Raises ValueError if the plan no longer matches plan_token.
+    """
+    with db.atomic('IMMEDIATE'):
+        plan = ledger_get_settlement_plan()
+        if ledger_settlement_plan_token(plan) != plan_token:
+            raise ValueError("The settlement plan has changed, please review it again")
+        return [
+            ledger_add(
+                event_id=None,
+                payer_id=debtor_id,
+                beneficiary_id=creditor_id,
+                amount=amount,
+            )
+            for debtor_id, creditor_id, amount in plan
+        ]
+
+
 def ledger_get_owed_to_user(user_id: int) -> List[Ledger]:
     """Get all ledger entries where user is owed money."""
     return (
@@ -279,15 +627,20 @@ def item_get_all():
 
 
 def item_get_all_with_stock():
-    items = Item.select().order_by(Item.name)
-    stocks = [
-        ItemStock.select()
-        .where(ItemStock.item == item)
-        .order_by(ItemStock.logged_at.desc())
-        .first()
-        for item in items
-    ]
-    return zip(items, stocks)
+    """Every item with its latest ItemStock (or None), one index seek per item."""
+    Latest = ItemStock.alias()
+    latest_id = (
+        ItemStock.select(ItemStock.id)
+        .where(ItemStock.item == Item.id)
+        .order_by(ItemStock.logged_at.desc(), ItemStock.id.desc())
+        .limit(1)
+    )
+    items = (
+        Item.select(Item, Latest)
+        .join(Latest, JOIN.LEFT_OUTER, on=(Latest.id == latest_id), attr="latest_stock")
+        .order_by(Item.name)
+    )
+    return [(item, item.latest_stock) for item in items]
 
 
 def item_get_by_id(item_id: int) -> Item:
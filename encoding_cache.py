@@ -0,0 +1,78 @@
+"""Persistent on-disk cache of face encodings keyed by image content hash."""
+import hashlib
+import io
+import os
+import tempfile
+from typing import Optional, Tuple
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.environ.get("DORMMON_ENCODING_CACHE", "face_cache")
+
+
+class EncodingCache:
+    """
+    Map the SHA-256 of an image's bytes to its face encoding.
+
+    Each entry is a small .npy file, so unchanged photos are never handed to
+    dlib again. Images without a face are cached too, as an empty array, so
+    they are not re-scanned either. Writes go through a temporary file and an
+    atomic rename, which makes the cache safe to share between processes.
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR):
+        self.directory = directory
+
+    @staticmethod
+    def digest(image_bytes: bytes) -> str:
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], f"{digest}.npy")
+
+    def get(self, digest: str) -> Tuple[bool, Optional[np.ndarray]]:
+        """Return (hit, encoding); encoding is None for images without a face."""
+        try:
+            encoding = np.load(self._path(digest), allow_pickle=False)
+        except (OSError, ValueError):
+            return False, None
+        return True, (encoding if encoding.size else None)
+
+    def put(self, digest: str, encoding: Optional[np.ndarray]):
+        """Store the encoding of an image, or None when it has no face."""
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        value = np.empty(0) if encoding is None else np.asarray(encoding)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                np.save(tmp, value, allow_pickle=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+encoding_cache = EncodingCache()
+
+
+def encode_face_from_bytes_cached(image_bytes: bytes) -> Optional[np.ndarray]:
+    """
+    Encode an in-memory image, reusing the cached encoding when available.
+    Returns None without caching when the image could not be processed.
+    """
+    from face_encoding import encode_face_from_image
+
+    digest = encoding_cache.digest(image_bytes)
+    hit, encoding = encoding_cache.get(digest)
+    if hit:
+        return encoding
+    try:
+        encoding = encode_face_from_image(io.BytesIO(image_bytes))
+    except Exception:
+        # Not cached: only a detection that ran and found no face is final
+        return None
+    encoding_cache.put(digest, encoding)
+    return encoding
@@ -0,0 +1,151 @@
+"""Background face enrollment jobs running image encoding on the worker pool."""
+import threading
+import time
+import uuid
+from concurrent.futures import wait
+from typing import Dict, List, Optional
+
+from database import db
+from encoding_cache import encode_face_from_bytes_cached, encoding_cache
+from gallery import face_gallery
+from recognition_service import enrollment_service
+
+JOB_RETENTION_SECONDS = 3600
+
+_jobs: Dict[str, "EnrollmentJob"] = {}
+_jobs_lock = threading.Lock()
+
+
+class EnrollmentJob:
+    """State of a single enrollment, polled by clients until it finishes."""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, name: str, total: int):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.total = total
+        self.completed = 0
+        self.faces_found = 0
+        self.status = self.PENDING
+        self.error: Optional[str] = None
+        self.user = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (self.DONE, self.FAILED)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "progress": {"completed": self.completed, "total": self.total},
+            "faces_found": self.faces_found,
+            "error": self.error,
+            "user": (
+                {
+                    "id": self.user.id,
+                    "name": self.user.name,
+                    "created_at": self.user.created_at.isoformat(),
+                }
+                if self.user
+                else None
+            ),
+        }
+
+
+def _prune_jobs():
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    with _jobs_lock:
+        for job_id in [
+            job_id
+            for job_id, job in _jobs.items()
+            if job.finished and job.finished_at < cutoff
+        ]:
+            del _jobs[job_id]
+
+
+def _fail(job: EnrollmentJob, message: str):
+    job.error = message
+    job.status = EnrollmentJob.FAILED
+    job.finished_at = time.time()
+
+
+def _run_job(job: EnrollmentJob, images: List[bytes]):
+    from database_access import user_add_if_not_exists
+    from face_encoding import (
+        average_encodings,
+        encode_face_to_bytes,
+        encode_samples_to_bytes,
+    )
+
+    job.status = EnrollmentJob.RUNNING
+
+    def on_done(_future):
+        job.completed += 1
+
+    try:
+        # Only images missing from the encoding cache go to the pool
+        results = []
+        futures = []
+        for data in images:
+            hit, encoding = encoding_cache.get(encoding_cache.digest(data))
+            if hit:
+                results.append(encoding)
+                job.completed += 1
+            else:
+                future = enrollment_service.submit(encode_face_from_bytes_cached, data)
+                future.add_done_callback(on_done)
+                futures.append(future)
+        wait(futures)
+        results.extend(future.result() for future in futures)
+        encodings = [enc for enc in results if enc is not None]
+    except Exception as exc:
+        _fail(job, f"Encoding failed: {exc}")
+        return
+
+    job.faces_found = len(encodings)
+    if not encodings:
+        _fail(job, "No faces detected in images")
+        return
+
+    try:
+        with db.connection_context():
+            job.user = user_add_if_not_exists(
+                job.name,
+                encode_face_to_bytes(average_encodings(encodings)),
+                encode_samples_to_bytes(encodings),
+            )
+    except Exception as exc:
+        _fail(job, f"Error: {exc}")
+        return
+    if job.user is None:
+        _fail(job, "User already exists")
+        return
+    # Only after the commit, so recognition never returns an uncommitted user
+    face_gallery.add_user(job.user)
+
+    job.status = EnrollmentJob.DONE
+    job.finished_at = time.time()
+
+
+def enrollment_submit(name: str, images: List[bytes]) -> EnrollmentJob:
+    """Start enrolling a user from raw image bytes and return the job."""
+    _prune_jobs()
+    job = EnrollmentJob(name, len(images))
+    with _jobs_lock:
+        _jobs[job.id] = job
+    threading.Thread(target=_run_job, args=(job, images), daemon=True).start()
+    return job
+
+
+def enrollment_get(job_id: str) -> Optional[EnrollmentJob]:
+    """Look up an enrollment job by id."""
+    with _jobs_lock:
+        return _jobs.get(job_id)
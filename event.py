@@ -1,44 +1,112 @@
+import json
 import os
 import uuid
+from datetime import datetime
 
 from flask import Response, render_template, request, url_for
 from PIL import Image
 
-from database import ItemStock
 from database_access import (
     category_get_all,
-    category_get_by_id,
-    event_add,
+    event_create,
+    event_create_many,
     event_get_by_id,
-    event_get_cost,
-    event_get_recent,
+    event_cursor,
+    event_get_recent_with_details,
     item_get_all,
-    item_get_by_id,
-    ledger_add,
     user_get_all,
-    user_get_by_id,
 )
 from response_helpers import json_error, json_response, wants_json_response
 
 
+def _save_photo(photo_file, upload_folder: str) -> str:
+    """Re-encode an uploaded photo as a JPEG in the upload folder."""
+    filename = f"{uuid.uuid4()}.jpg"
+    img = Image.open(photo_file)
+    img = img.convert('RGB')
+    img.save(os.path.join(upload_folder, filename), 'JPEG', optimize=True, quality=70)
+    return filename
+
+
+def _remove_photos(filenames, upload_folder: str):
+    """Delete photos saved for events that were rolled back."""
+    for filename in filenames:
+        try:
+            os.remove(os.path.join(upload_folder, filename))
+        except OSError:
+            pass
+
+
+def _parse_logged_at(value: str) -> datetime:
+    """Parse an ISO timestamp into the naive local time the Event table stores."""
+    logged_at = datetime.fromisoformat(value)
+    if logged_at.tzinfo is not None:
+        logged_at = logged_at.astimezone().replace(tzinfo=None)
+    return logged_at
+
+
+def _parse_batch_entry(entry: dict) -> dict:
+    """Validate one /events/batch entry into event_create_many() fields."""
+    if not isinstance(entry, dict):
+        raise ValueError("each event must be an object")
+    stock = entry.get("stock")
+    has_stock = entry.get("item_id") is not None and stock not in (None, "")
+    logged_at = entry.get("logged_at")
+    return {
+        "user_id": int(entry["user_id"]),
+        "category_id": int(entry["category_id"]),
+        "notes": str(entry.get("notes") or ""),
+        "item_id": int(entry["item_id"]) if has_stock else None,
+        "stock": int(stock) if has_stock else None,
+        "cost": int(entry["cost"]) if entry.get("cost") is not None else None,
+        "sharer_ids": [int(cs) for cs in entry.get("costsharers") or []],
+        "logged_at": _parse_logged_at(logged_at) if logged_at else None,
+    }
+
+
+def _event_photo_json(event) -> dict:
+    return {
+        "filename": event.photo_path,
+        "url": url_for('download_file', name=event.photo_path, _external=True),
+    }
+
+
 def routes(app):
     @app.route("/events")
     def event_list():
-        """List recent events."""
+        """
+        List recent events, newest first. Pages are chained with the
+        `before` (older) and `after` (newer) cursors of the response.
+        """
         limit = request.args.get("limit", type=int) or 50
         category_id = request.args.get("category_id", type=int)
         category_name = request.args.get("category_name")
+        before = request.args.get("before")
+        after = request.args.get("after")
 
-        events = list(
-            event_get_recent(
-                limit=limit, category_id=category_id, category_name=category_name
+        # Joins and prefetched ledger rows: a fixed number of queries per page.
+        # One extra row tells whether another page follows.
+        try:
+            events_with_cost = event_get_recent_with_details(
+                limit=limit + 1,
+                category_id=category_id,
+                category_name=category_name,
+                before=before,
+                after=after,
             )
-        )
-        # Calculate cost for each event from ledger entries
-        events_with_cost = []
-        for event in events:
-            cost = event_get_cost(event.id)
-            events_with_cost.append((event, cost))
+        except ValueError as e:
+            if wants_json_response():
+                return json_error(str(e), 400)
+            return render_template('dialogs/error.html', error=str(e)), 400
+        has_more = len(events_with_cost) > limit
+        if has_more:
+            events_with_cost = events_with_cost[1:] if after else events_with_cost[:limit]
+
+        older_exist = bool(events_with_cost) if after else has_more
+        cursors = {
+            "before": event_cursor(events_with_cost[-1][0]) if older_exist else None,
+            "after": event_cursor(events_with_cost[0][0]) if events_with_cost else after,
+        }
 
         if wants_json_response():
             return json_response(
@@ -87,11 +155,26 @@ def routes(app):
                             ),
                         }
                         for event, cost in events_with_cost
-                    ]
+                    ],
+                    "cursors": cursors,
+                    "has_more": has_more,
                 }
             )
 
-        return render_template('events.html', events_with_cost=events_with_cost)
+        more_url = None
+        if cursors["before"] and not after:
+            more_url = url_for(
+                'event_list',
+                before=cursors["before"],
+                limit=limit,
+                category_id=category_id,
+                category_name=category_name,
+            )
+        # Follow-up pages only need their rows, appended by the "load more" row
+        template = 'events_rows.html' if before or after else 'events.html'
+        return render_template(
+            template, events_with_cost=events_with_cost, more_url=more_url
+        )
 
 
     @app.route("/dialog/add_event")
@@ -122,67 +205,26 @@ def routes(app):
             return render_template('dialogs/error.html', error="Photo is required"), 400
     
         try:
-            # Validate user and category exist
-            payer = user_get_by_id(int(user_id))
-            category_get_by_id(int(category_id))
-        
-            # Save photo
-            filename = f"{uuid.uuid4()}.jpg"
-            photo_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            img = Image.open(photo_file)
-            img = img.convert('RGB')
-            img.save(photo_path, 'JPEG', optimize=True, quality=70)        
-
-            # Handle stock
-            item_stock_id = None
-            if item_id and stock and stock.strip():
-                # Validate item exists
-                item = item_get_by_id(int(item_id))
-                stock_value = int(stock)
-                
-                # Create ItemStock record
-                item_stock = ItemStock.create(item=item, stock=stock_value)
-                item_stock_id = item_stock.id
-        
-            # Handle cost
-            sharer_ids = []
-            if cost is not None:
-                cost = int(cost)
-
-                # Determine who shares the cost
-                if costsharers:
-                    # Only selected users share the cost
-                    sharer_ids = [int(cs) for cs in costsharers]
-                    if payer.id not in sharer_ids:
-                        sharer_ids.append(payer.id)  # Include payer
-                else:
-                    # All users share the cost
-                    all_users = user_get_all()
-                    sharer_ids = [u.id for u in all_users]
-                
-                # Calculate amount per person
-                num_sharers = len(sharer_ids)
-                amount_per_person = round(cost / num_sharers)
-                
-        
-            # Create event
-            event = event_add(
-                user_id=int(user_id),
-                category_id=int(category_id),
-                photo_path=filename,
-                notes=notes,
-                item_stock_id=item_stock_id
-            )
-        
-            # Create ledger entries after event is inserted: payer pays for each sharer
-            for sharer_id in sharer_ids:
-                ledger_add(
-                    event_id=event.id,
-                    payer_id=payer.id,
-                    beneficiary_id=sharer_id,
-                    amount=amount_per_person,
+            cost = int(cost) if cost is not None else None
+            has_stock = bool(item_id and stock and stock.strip())
+            filename = _save_photo(photo_file, app.config['UPLOAD_FOLDER'])
+
+            # Stock reading, event and ledger rows commit together or not at all
+            try:
+                event = event_create(
+                    user_id=int(user_id),
+                    category_id=int(category_id),
+                    photo_path=filename,
+                    notes=notes,
+                    item_id=int(item_id) if has_stock else None,
+                    stock=int(stock) if has_stock else None,
+                    cost=cost,
+                    sharer_ids=[int(cs) for cs in costsharers],
                 )
-        
+            except Exception:
+                _remove_photos([filename], app.config['UPLOAD_FOLDER'])
+                raise
+
             if wants_json_response():
                 return json_response(
                     {
@@ -192,12 +234,7 @@ def routes(app):
                             "user_id": event.user.id,
                             "category_id": event.category.id,
                             "notes": event.notes,
-                            "photo": {
-                                "filename": event.photo_path,
-                                "url": url_for(
-                                    'download_file', name=event.photo_path, _external=True
-                                ),
-                            },
+                            "photo": _event_photo_json(event),
                         },
                     }
                 )
@@ -216,6 +253,61 @@ def routes(app):
                 return json_error(str(e), 400)
             return render_template('dialogs/error.html', error=f"Error: {str(e)}"), 400
 
+    @app.route("/events/batch", methods=["POST"])
+    def event_batch_handle():
+        """
+        Create many events in one transaction, e.g. when a kiosk flushes
+        work it buffered while offline. The "events" form field is a JSON
+        list of objects with the /events fields (costsharers as a list), an
+        optional ISO "logged_at", and "photo": the name of the multipart part
+        holding that event's photo. Either every event is stored or none is.
+        """
+        try:
+            entries = json.loads(request.form.get("events") or "null")
+        except ValueError:
+            return json_error("events must be a JSON list", 400)
+        if not isinstance(entries, list) or not entries:
+            return json_error("events must be a non-empty JSON list", 400)
+
+        specs = []
+        photos = []
+        for index, entry in enumerate(entries):
+            try:
+                specs.append(_parse_batch_entry(entry))
+            except (KeyError, TypeError, ValueError) as e:
+                return json_error(f"Invalid input in event {index}: {str(e)}", 400)
+            photo = request.files.get(str(entry.get("photo") or ""))
+            if not photo or not photo.filename:
+                return json_error(f"Photo is required for event {index}", 400)
+            photos.append(photo)
+
+        filenames = []
+        try:
+            for spec, photo in zip(specs, photos):
+                filenames.append(_save_photo(photo, app.config['UPLOAD_FOLDER']))
+                spec["photo_path"] = filenames[-1]
+            events = event_create_many(specs)
+        except Exception as e:
+            _remove_photos(filenames, app.config['UPLOAD_FOLDER'])
+            return json_error(str(e), 400)
+
+        return json_response(
+            {
+                "message": f"{len(events)} events added successfully!",
+                "events": [
+                    {
+                        "id": event.id,
+                        "user_id": event.user_id,
+                        "category_id": event.category_id,
+                        "notes": event.notes,
+                        "logged_at": event.logged_at.isoformat(),
+                        "photo": _event_photo_json(event),
+                    }
+                    for event in events
+                ],
+            }
+        )
+
     @app.route("/dialog/eventpic/<int:event_id>")
     def event_picture_view(event_id):
         event = event_get_by_id(event_id)
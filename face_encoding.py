@@ -1,8 +1,21 @@
 """Face encoding utilities for user face recognition."""
-import face_recognition
+import struct
 import numpy as np
 from typing import List, Optional
 
+# Stored blobs: a fixed 16-byte header followed by the (count, dim) samples.
+#   magic "DMFE" | version u8 | dtype code u8 | dim u16 | count u32 | padding
+# Blobs without the magic are legacy raw float64 arrays.
+BLOB_MAGIC = b"DMFE"
+BLOB_VERSION = 1
+_HEADER = struct.Struct("<4sBBHI4x")
+_DTYPE_CODES = {1: np.dtype("<f2"), 2: np.dtype("<f4"), 3: np.dtype("<f8")}
+_CODES_BY_DTYPE = {dtype: code for code, dtype in _DTYPE_CODES.items()}
+LEGACY_DIM = 128
+
+# Precision new blobs are written with, see set_storage_dtype()
+storage_dtype = np.dtype("<f4")
+
 
 def encode_face_from_image(image_path: str) -> Optional[np.ndarray]:
     """
@@ -13,15 +26,18 @@ def encode_face_from_image(image_path: str) -> Optional[np.ndarray]:
         
     Returns:
         Face encoding array or None if no face found
+
+    Raises:
+        Whatever loading or dlib raises, so failures are not mistaken for
+        images without a face
     """
-    try:
-        image = face_recognition.load_image_file(image_path)
-        encodings = face_recognition.face_encodings(image)
-        if encodings:
-            return encodings[0]
-        return None
-    except Exception:
-        return None
+    import face_recognition
+
+    image = face_recognition.load_image_file(image_path)
+    encodings = face_recognition.face_encodings(image)
+    if encodings:
+        return encodings[0]
+    return None
 
 
 def average_encodings(encodings: List[np.ndarray]) -> np.ndarray:
@@ -39,12 +55,61 @@ def average_encodings(encodings: List[np.ndarray]) -> np.ndarray:
     return np.mean(encodings, axis=0)
 
 
+def set_storage_dtype(name: str):
+    """Choose the precision of newly written blobs ("float32" or "float16")."""
+    global storage_dtype
+    dtype = np.dtype(name).newbyteorder("<")
+    if dtype not in _CODES_BY_DTYPE:
+        raise ValueError(f"Unsupported face encoding dtype: {name}")
+    storage_dtype = dtype
+
+
+def is_legacy_blob(blob: bytes) -> bool:
+    """True for headerless float64 blobs written before the versioned format."""
+    return bytes(blob[:len(BLOB_MAGIC)]) != BLOB_MAGIC
+
+
+def pack_encodings(encodings: np.ndarray, dtype: Optional[np.dtype] = None) -> bytes:
+    """Serialize an (n, dim) encoding array into a versioned blob."""
+    dtype = storage_dtype if dtype is None else np.dtype(dtype).newbyteorder("<")
+    encodings = np.atleast_2d(np.asarray(encodings)).astype(dtype, copy=False)
+    count, dim = encodings.shape
+    header = _HEADER.pack(BLOB_MAGIC, BLOB_VERSION, _CODES_BY_DTYPE[dtype], dim, count)
+    return header + encodings.tobytes()
+
+
+def unpack_encodings(blob: bytes) -> np.ndarray:
+    """
+    Deserialize a blob into an (n, dim) array without copying the payload.
+    The result is a read-only view in the stored dtype.
+    """
+    if is_legacy_blob(blob):
+        return np.frombuffer(blob, dtype=np.float64).reshape(-1, LEGACY_DIM)
+    magic, version, code, dim, count = _HEADER.unpack_from(blob)
+    if version != BLOB_VERSION or code not in _DTYPE_CODES:
+        raise ValueError(f"Unsupported face encoding blob (version {version}, dtype {code})")
+    return np.frombuffer(
+        blob, dtype=_DTYPE_CODES[code], count=count * dim, offset=_HEADER.size
+    ).reshape(count, dim)
+
+
 def encode_face_to_bytes(encoding: np.ndarray) -> bytes:
     """Convert face encoding array to bytes for storage."""
-    return encoding.tobytes()
+    return pack_encodings(encoding)
 
 
 def decode_face_from_bytes(face_bytes: bytes) -> np.ndarray:
     """Convert bytes back to face encoding array."""
-    return np.frombuffer(face_bytes, dtype=np.float64)
+    return unpack_encodings(face_bytes)[0]
+
+
+def encode_samples_to_bytes(encodings: List[np.ndarray]) -> bytes:
+    """Pack every enrollment encoding of a user into a single blob."""
+    if not len(encodings):
+        raise ValueError("Cannot pack empty list of encodings")
+    return pack_encodings(np.vstack(encodings))
+
 
+def decode_samples_from_bytes(samples_bytes: bytes) -> np.ndarray:
+    """Unpack a samples blob into an (n, 128) encoding array."""
+    return unpack_encodings(samples_bytes)
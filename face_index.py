@@ -0,0 +1,96 @@
+"""Inverted-file (IVF) approximate nearest-neighbour index over face encodings."""
+from typing import Optional
+
+import numpy as np
+
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 10
+KMEANS_MAX_TRAINING_ROWS_PER_LIST = 64
+
+
+def _squared_distances(a: np.ndarray, b: np.ndarray, b_norms: np.ndarray) -> np.ndarray:
+    a_norms = np.einsum("ij,ij->i", a, a)
+    return a_norms[:, np.newaxis] + b_norms[np.newaxis, :] - 2.0 * (a @ b.T)
+
+
+def _kmeans(data: np.ndarray, nlist: int, rng: np.random.Generator) -> np.ndarray:
+    """Lloyd's k-means on (a sample of) the data; returns (nlist, D) centroids."""
+    max_rows = nlist * KMEANS_MAX_TRAINING_ROWS_PER_LIST
+    if data.shape[0] > max_rows:
+        data = data[rng.choice(data.shape[0], max_rows, replace=False)]
+    centroids = data[rng.choice(data.shape[0], nlist, replace=False)].copy()
+
+    for _ in range(KMEANS_ITERATIONS):
+        norms = np.einsum("ij,ij->i", centroids, centroids)
+        assignment = np.argmin(_squared_distances(data, centroids, norms), axis=1)
+        counts = np.bincount(assignment, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, np.newaxis]
+        # Re-seed empty lists from random rows so every list stays useful
+        if empty.any():
+            centroids[empty] = data[rng.choice(data.shape[0], int(empty.sum()))]
+    return centroids
+
+
+class IVFIndex:
+    """
+    Coarse quantizer that partitions encodings into sqrt(N) k-means lists.
+
+    A query only scans the rows of the `nprobe` lists whose centroids are
+    closest, so its cost grows with sqrt(N) instead of N. Lists are stored in
+    CSR form: `order` holds row numbers grouped by list and `offsets` marks
+    where each list starts. Inserting rows assigns them to the nearest
+    existing centroid; centroids are only retrained by a full rebuild.
+    """
+
+    def __init__(self, centroids: np.ndarray, assignment: np.ndarray, nprobe: int = DEFAULT_NPROBE):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        self.assignment = assignment
+        self.nprobe = nprobe
+        self.order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=self.centroids.shape[0])
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    @classmethod
+    def train(
+        cls,
+        encodings: np.ndarray,
+        nlist: Optional[int] = None,
+        nprobe: int = DEFAULT_NPROBE,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        encodings = np.asarray(encodings, dtype=np.float32)
+        nlist = nlist or max(1, int(np.sqrt(encodings.shape[0])))
+        nlist = min(nlist, encodings.shape[0])
+        centroids = _kmeans(encodings, nlist, np.random.default_rng(seed))
+        return cls(centroids, cls._assign(centroids, encodings), nprobe)
+
+    @staticmethod
+    def _assign(centroids: np.ndarray, encodings: np.ndarray) -> np.ndarray:
+        norms = np.einsum("ij,ij->i", centroids, centroids)
+        return np.argmin(_squared_distances(encodings, centroids, norms), axis=1)
+
+    def __len__(self) -> int:
+        return self.assignment.shape[0]
+
+    def with_added(self, encodings: np.ndarray) -> "IVFIndex":
+        """Return a new index with rows appended after the existing ones."""
+        encodings = np.atleast_2d(np.asarray(encodings, dtype=np.float32))
+        assignment = np.concatenate(
+            [self.assignment, self._assign(self.centroids, encodings)]
+        )
+        return IVFIndex(self.centroids, assignment, self.nprobe)
+
+    def candidates(self, probe: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """Return the sorted row numbers stored in the lists closest to the probe."""
+        nprobe = min(nprobe or self.nprobe, self.centroids.shape[0])
+        probe = np.asarray(probe, dtype=np.float32).reshape(1, -1)
+        distances = _squared_distances(probe, self.centroids, self.centroid_norms)[0]
+        lists = np.argpartition(distances, nprobe - 1)[:nprobe]
+        rows = np.concatenate(
+            [self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists]
+        )
+        return np.sort(rows)
@@ -0,0 +1,107 @@
+"""Configurable detect-and-encode pipeline used for recognition requests."""
+import math
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+DETECTOR_MODELS = ("hog", "cnn")
+
+
+class PipelineSettings(NamedTuple):
+    """Per-deployment knobs trading recognition accuracy for latency."""
+
+    max_side: int = 640  # Longest side of the working image, 0 = full size
+    model: str = "hog"  # Face detector, "hog" (CPU) or "cnn" (dlib CNN)
+    upsample: int = 1  # Times the detector upsamples to find small faces
+    jitters: int = 1  # Re-samples per face when encoding
+
+    @classmethod
+    def from_config(cls, config) -> "PipelineSettings":
+        settings = cls(
+            max_side=int(config.get("FACE_WORKING_SIZE", cls._field_defaults["max_side"])),
+            model=config.get("FACE_DETECTOR_MODEL", cls._field_defaults["model"]),
+            upsample=int(config.get("FACE_UPSAMPLE", cls._field_defaults["upsample"])),
+            jitters=int(config.get("FACE_JITTERS", cls._field_defaults["jitters"])),
+        )
+        if settings.model not in DETECTOR_MODELS:
+            raise ValueError(f"Unknown face detector model: {settings.model}")
+        return settings
+
+
+class FaceDetection(NamedTuple):
+    """A detected face; location is (top, right, bottom, left) in the original image."""
+
+    location: Tuple[int, int, int, int]
+    encoding: np.ndarray
+
+
+def load_image_scaled(stream, max_side: int) -> Tuple[np.ndarray, float]:
+    """
+    Decode an image no larger than max_side on its longest side.
+
+    JPEGs are decoded with PIL draft mode, which lets libjpeg skip most of the
+    IDCT work by decoding directly at 1/2, 1/4 or 1/8 scale. Returns the RGB
+    array and the factor mapping working coordinates back to the original.
+    """
+    image = Image.open(stream)
+    original_width = image.width
+    if max_side and max(image.size) > max_side:
+        # draft() only picks a reduced scale that keeps both sides at least
+        # as large as requested, so ask for the aspect-preserving target size
+        scale = max_side / max(image.size)
+        target = (math.ceil(image.width * scale), math.ceil(image.height * scale))
+        image.draft("RGB", target)
+    image = image.convert("RGB")
+    if max_side and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side))
+    return np.asarray(image), original_width / image.width
+
+
+def locate_faces(image: np.ndarray, settings: PipelineSettings) -> List[tuple]:
+    """Run the configured detector on a working image."""
+    import face_recognition
+
+    return face_recognition.face_locations(
+        image, number_of_times_to_upsample=settings.upsample, model=settings.model
+    )
+
+
+def encode_faces(
+    image: np.ndarray, locations: List[tuple], settings: PipelineSettings
+) -> List[np.ndarray]:
+    """Compute the 128-d encoding of each located face."""
+    import face_recognition
+
+    return face_recognition.face_encodings(
+        image, known_face_locations=locations, num_jitters=settings.jitters
+    )
+
+
+def detect_faces(
+    stream, settings: PipelineSettings, timings: Optional[Dict[str, float]] = None
+) -> List[FaceDetection]:
+    """
+    Detect and encode every face in an uploaded image.
+    When given, `timings` receives the decode/detect/encode durations in ms.
+    """
+    timings = {} if timings is None else timings
+    started = time.perf_counter()
+    image, scale = load_image_scaled(stream, settings.max_side)
+    decoded = time.perf_counter()
+    locations = locate_faces(image, settings)
+    detected = time.perf_counter()
+    timings["decode"] = (decoded - started) * 1000.0
+    timings["detect"] = (detected - decoded) * 1000.0
+    if not locations:
+        return []
+    encodings = encode_faces(image, locations, settings)
+    timings["encode"] = (time.perf_counter() - detected) * 1000.0
+    return [
+        FaceDetection(
+            location=tuple(int(round(coord * scale)) for coord in location),
+            encoding=encoding,
+        )
+        for location, encoding in zip(locations, encodings)
+    ]
@@ -0,0 +1,117 @@
+"""In-memory gallery of registered user face encodings."""
+import threading
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from database import User
+from face_index import DEFAULT_NPROBE
+from matcher import FaceMatcher
+
+ENCODING_DIM = 128
+DEFAULT_INDEX_THRESHOLD = 5000
+
+
+class GallerySnapshot(NamedTuple):
+    """Immutable view of the gallery at a point in time."""
+
+    matcher: FaceMatcher  # Over every stored sample, labelled by user index
+    user_ids: np.ndarray  # (U,)
+    names: List[str]
+    version: int = 0  # Bumped whenever the gallery changes
+
+
+def _user_samples(face_encoding: bytes, face_samples: Optional[bytes]) -> np.ndarray:
+    """Return every stored sample of a user, falling back to the average."""
+    from face_encoding import decode_face_from_bytes, decode_samples_from_bytes
+
+    if face_samples:
+        return decode_samples_from_bytes(face_samples)
+    return decode_face_from_bytes(face_encoding).reshape(1, -1)
+
+
+class FaceGallery:
+    """
+    Process-wide cache of the stacked face encodings of every user.
+
+    The gallery is loaded from the database on first use and patched in place
+    when users are added, so recognition requests neither scan the User table
+    nor decode encoding blobs. Updates swap in a new snapshot instead of
+    mutating the current one, so readers never need to hold the lock.
+
+    Once the gallery holds more than `index_threshold` samples, the matcher
+    gets an IVF index; new users are inserted into it incrementally.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._version = 0
+        self.index_threshold = DEFAULT_INDEX_THRESHOLD
+        self.nprobe = DEFAULT_NPROBE
+
+    def configure(self, index_threshold: int, nprobe: int):
+        """Set when and how the approximate index is used; drops the cache."""
+        self.index_threshold = index_threshold
+        self.nprobe = nprobe
+        self.invalidate()
+
+    def _with_index_if_large(self, matcher: FaceMatcher) -> FaceMatcher:
+        if matcher.index is None and len(matcher) > self.index_threshold:
+            return matcher.with_index(self.nprobe)
+        return matcher
+
+    def snapshot(self) -> GallerySnapshot:
+        """Return the current gallery, loading it from the database if needed."""
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None:
+                self._version += 1
+                self._snapshot = self._load()._replace(version=self._version)
+            return self._snapshot
+
+    def add_user(self, user: User):
+        """Append a newly created user to the gallery if it is already loaded."""
+        samples = _user_samples(user.face_encoding, user.face_samples)
+        with self._lock:
+            current = self._snapshot
+            if current is None:
+                return
+            matcher = current.matcher.with_added(samples, label=len(current.names))
+            self._version += 1
+            self._snapshot = GallerySnapshot(
+                matcher=self._with_index_if_large(matcher),
+                user_ids=np.append(current.user_ids, user.id),
+                names=current.names + [user.name],
+                version=self._version,
+            )
+
+    def invalidate(self):
+        """Drop the cached gallery so the next access reloads it."""
+        with self._lock:
+            self._snapshot = None
+
+    def _load(self) -> GallerySnapshot:
+        rows = list(
+            User.select(User.id, User.name, User.face_encoding, User.face_samples)
+            .order_by(User.name)
+            .tuples()
+        )
+        if not rows:
+            return GallerySnapshot(
+                matcher=FaceMatcher(np.empty((0, ENCODING_DIM), dtype=np.float32)),
+                user_ids=np.empty(0, dtype=np.int64),
+                names=[],
+            )
+        samples = [_user_samples(enc, samples) for _, _, enc, samples in rows]
+        labels = np.repeat(np.arange(len(samples)), [s.shape[0] for s in samples])
+        return GallerySnapshot(
+            matcher=self._with_index_if_large(FaceMatcher(np.vstack(samples), labels)),
+            user_ids=np.array([user_id for user_id, _, _, _ in rows], dtype=np.int64),
+            names=[name for _, name, _, _ in rows],
+        )
+
+
+face_gallery = FaceGallery()
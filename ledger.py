@@ -4,10 +4,26 @@ from database_access import (
     user_get_all,
     user_get_by_id,
     ledger_add,
+    ledger_get_net_positions,
+    ledger_get_settlement_plan,
+    ledger_settle_all,
+    ledger_settlement_plan_token,
 )
 from response_helpers import json_error, json_response, wants_json_response
 
 
+def _transfers(pairs, names):
+    """Serialize (debtor_id, creditor_id, amount) tuples for responses."""
+    return [
+        {
+            "from_user": {"id": debtor_id, "name": names.get(debtor_id)},
+            "to_user": {"id": creditor_id, "name": names.get(creditor_id)},
+            "amount": amount,
+        }
+        for debtor_id, creditor_id, amount in pairs
+    ]
+
+
 def routes(app):
     @app.route("/dialog/pay")
     def ledger_pay_dialog():
@@ -101,4 +117,75 @@ def routes(app):
                 return json_error(str(e), 400)
             return render_template('dialogs/error.html', error=f"Error: {str(e)}"), 400
 
+    @app.route("/dialog/settle")
+    @app.route("/ledger/settle")
+    def ledger_settle_plan():
+        """Show each user's net position and the fewest payments that settle everything."""
+        names = {user.id: user.name for user in user_get_all()}
+        balances = [
+            {"user": {"id": user_id, "name": names.get(user_id)}, "balance": balance}
+            for user_id, balance in sorted(ledger_get_net_positions().items())
+        ]
+        plan = ledger_get_settlement_plan()
+        plan_token = ledger_settlement_plan_token(plan)
+
+        if wants_json_response():
+            return json_response(
+                {
+                    "balances": balances,
+                    "plan": _transfers(plan, names),
+                    "plan_token": plan_token,
+                }
+            )
+
+        return render_template(
+            'dialogs/settle.html',
+            balances=balances,
+            plan=_transfers(plan, names),
+            plan_token=plan_token,
+        )
+
+    @app.route("/ledger/settle", methods=["POST"])
+    def ledger_settle_handle():
+        """Record every payment of the settlement plan the client confirmed."""
+        plan_token = request.form.get('plan_token')
+        if not plan_token:
+            message = "plan_token is required"
+            if wants_json_response():
+                return json_error(message, 400)
+            return render_template('dialogs/error.html', error=message), 400
+
+        try:
+            entries = ledger_settle_all(plan_token)
+        except ValueError as e:
+            # The ledger changed since the plan was shown
+            if wants_json_response():
+                return json_error(str(e), 409)
+            return render_template('dialogs/error.html', error=str(e)), 409
+        except Exception as e:
+            if wants_json_response():
+                return json_error(str(e), 400)
+            return render_template('dialogs/error.html', error=f"Error: {str(e)}"), 400
+
+        message = f"Recorded {len(entries)} payments, everyone is settled up!"
+        if wants_json_response():
+            return json_response(
+                {
+                    "message": message,
+                    "ledger_entries": [
+                        {
+                            "id": entry.id,
+                            "payer_id": entry.payer_id,
+                            "beneficiary_id": entry.beneficiary_id,
+                            "amount": entry.amount,
+                            "created_at": entry.created_at.isoformat(),
+                        }
+                        for entry in entries
+                    ],
+                }
+            )
 
+        resp = render_template('dialogs/success.html', message=message)
+        resp = Response(resp)
+        resp.headers['HX-Trigger'] = 'userUpdated'
+        return resp
@@ -0,0 +1,213 @@
+"""Vectorized nearest-neighbour matching of face encodings."""
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from face_index import IVFIndex
+
+DEFAULT_TOLERANCE = 0.6
+DEFAULT_K = 3
+
+
+class MatchResult(NamedTuple):
+    """Outcome of matching one probe encoding against the gallery."""
+
+    index: int  # Label (e.g. user index) that won the vote
+    distance: float  # Distance to the closest sample of that label
+    runner_up_distance: Optional[float]  # Closest sample of any other label
+    margin: Optional[float]  # runner_up_distance - distance, negative if the vote beat a closer label
+    is_match: bool  # At least one of the k nearest samples is within tolerance
+    votes: float = 0.0  # Share of the k-NN vote weight held by the winner
+
+    @property
+    def confidence(self) -> float:
+        return max(0.0, 1.0 - self.distance)
+
+
+class FaceMatcher:
+    """
+    Euclidean k-NN matcher over a contiguous float32 (M, 128) sample matrix.
+
+    Each sample carries an integer label (the owning user), and several
+    samples may share a label. Squared norms of the samples are computed once,
+    so each query reduces to a single matrix product:
+    |g - p|^2 = |g|^2 + |p|^2 - 2 g.p. The k nearest samples within tolerance
+    vote for their label, weighted by inverse distance, so several close
+    samples of one user can outweigh a single slightly closer sample of
+    another. Samples are kept sorted by label so per-label minima come from
+    one reduceat, and the whole match stays linear in the number of samples.
+
+    With an IVFIndex attached, each probe is only compared exactly against the
+    candidates from the closest index lists (exact rerank of the approximate
+    shortlist), which keeps large galleries sub-linear.
+    """
+
+    def __init__(
+        self,
+        encodings: np.ndarray,
+        labels: Optional[np.ndarray] = None,
+        tolerance: float = DEFAULT_TOLERANCE,
+        k: int = DEFAULT_K,
+        index: Optional[IVFIndex] = None,
+    ):
+        encodings = np.asarray(encodings, dtype=np.float32)
+        if encodings.ndim != 2:
+            raise ValueError("Gallery encodings must be a 2D array")
+        if labels is None:
+            labels = np.arange(encodings.shape[0])
+        labels = np.asarray(labels, dtype=np.int64)
+        if labels.shape[0] != encodings.shape[0]:
+            raise ValueError("Expected one label per encoding")
+
+        order = np.argsort(labels, kind="stable")
+        if index is not None and np.any(order != np.arange(order.shape[0])):
+            raise ValueError("An index requires encodings already sorted by label")
+        self.encodings = np.ascontiguousarray(encodings[order])
+        self.labels = labels[order]
+        self.norms = np.einsum("ij,ij->i", self.encodings, self.encodings)
+        self.label_values = np.unique(self.labels)
+        self.label_positions = np.searchsorted(self.label_values, self.labels)
+        self.tolerance = tolerance
+        self.k = k
+        self.index = index
+
+    def __len__(self) -> int:
+        return self.encodings.shape[0]
+
+    def with_index(self, nprobe: int) -> "FaceMatcher":
+        """Return a copy of this matcher with a freshly trained IVF index."""
+        return FaceMatcher(
+            self.encodings,
+            self.labels,
+            self.tolerance,
+            self.k,
+            IVFIndex.train(self.encodings, nprobe=nprobe),
+        )
+
+    def with_added(self, encodings: np.ndarray, label: int) -> "FaceMatcher":
+        """
+        Return a new matcher with samples of a new label appended.
+        The index, if any, is extended incrementally instead of retrained.
+        """
+        encodings = np.atleast_2d(np.asarray(encodings, dtype=np.float32))
+        labels = np.full(encodings.shape[0], label, dtype=np.int64)
+        index = self.index
+        if index is not None and len(self) and label < self.labels[-1]:
+            index = None
+        return FaceMatcher(
+            np.vstack([self.encodings, encodings]),
+            np.concatenate([self.labels, labels]),
+            self.tolerance,
+            self.k,
+            index.with_added(encodings) if index is not None else None,
+        )
+
+    def distances(self, probes: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Return the (P, M) matrix of distances from each probe to every (or the given) sample."""
+        probes = np.atleast_2d(np.asarray(probes, dtype=np.float32))
+        encodings = self.encodings if rows is None else self.encodings[rows]
+        norms = self.norms if rows is None else self.norms[rows]
+        probe_norms = np.einsum("ij,ij->i", probes, probes)
+        squared = norms[np.newaxis, :] + probe_norms[:, np.newaxis]
+        squared -= 2.0 * (probes @ encodings.T)
+        np.maximum(squared, 0.0, out=squared)
+        return np.sqrt(squared, out=squared)
+
+    def match_many(
+        self,
+        probes: np.ndarray,
+        tolerance: Optional[float] = None,
+        k: Optional[int] = None,
+    ) -> List[MatchResult]:
+        """Match a batch of probes in one call."""
+        if len(self) == 0:
+            raise ValueError("Cannot match against an empty gallery")
+        tolerance = self.tolerance if tolerance is None else tolerance
+        k = self.k if k is None else k
+        probes = np.atleast_2d(np.asarray(probes, dtype=np.float32))
+
+        if self.index is None:
+            return self._vote(self.distances(probes), self.label_positions, tolerance, k)
+
+        results = []
+        for probe in probes:
+            rows = self.index.candidates(probe)
+            results += self._vote(
+                self.distances(probe, rows), self.label_positions[rows], tolerance, k
+            )
+        return results
+
+    def match(
+        self,
+        probe: np.ndarray,
+        tolerance: Optional[float] = None,
+        k: Optional[int] = None,
+    ) -> MatchResult:
+        """Match a single probe encoding."""
+        return self.match_many(probe, tolerance, k)[0]
+
+    def _vote(
+        self,
+        distances: np.ndarray,
+        positions: np.ndarray,
+        tolerance: float,
+        k: int,
+    ) -> List[MatchResult]:
+        """
+        Vote over a (P, C) distance matrix whose columns are samples with
+        the given (sorted) label positions.
+        """
+        num_probes, num_columns = distances.shape
+        k = min(k, num_columns)
+        rows = np.arange(num_probes)
+        candidate_labels, starts = np.unique(positions, return_index=True)
+        local_positions = np.searchsorted(candidate_labels, positions)
+        num_labels = candidate_labels.shape[0]
+
+        # Closest sample per label, (P, L)
+        label_min = np.minimum.reduceat(distances, starts, axis=1)
+
+        # Inverse-distance weighted vote among the k nearest samples in tolerance
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        nearest_dist = distances[rows[:, np.newaxis], nearest]
+        weights = np.where(
+            nearest_dist <= tolerance, 1.0 / (nearest_dist + 1e-6), 0.0
+        )
+        votes = np.zeros((num_probes, num_labels))
+        np.add.at(
+            votes,
+            (np.repeat(rows, k), local_positions[nearest].ravel()),
+            weights.ravel(),
+        )
+        has_votes = votes.max(axis=1) > 0
+        winner = np.where(
+            has_votes, np.argmax(votes, axis=1), np.argmin(label_min, axis=1)
+        )
+        total_votes = votes.sum(axis=1)
+        vote_share = np.divide(
+            votes[rows, winner],
+            total_votes,
+            out=np.zeros(num_probes),
+            where=total_votes > 0,
+        )
+
+        best_dist = label_min[rows, winner]
+        if num_labels > 1:
+            others = label_min.copy()
+            others[rows, winner] = np.inf
+            runner_up = others.min(axis=1)
+        else:
+            runner_up = None
+
+        winner_labels = self.label_values[candidate_labels[winner]]
+        return [
+            MatchResult(
+                index=int(winner_labels[i]),
+                distance=float(best_dist[i]),
+                runner_up_distance=None if runner_up is None else float(runner_up[i]),
+                margin=None if runner_up is None else float(runner_up[i] - best_dist[i]),
+                is_match=bool(has_votes[i]),
+                votes=float(vote_share[i]),
+            )
+            for i in rows
+        ]
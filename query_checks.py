@@ -0,0 +1,192 @@
+"""
+Checks on the SQL issued by the data access layer.
+
+Queries are captured from peewee's debug logger while the real access
+functions run, so the checks always see the SQL the application sends.
+"""
+import logging
+import os
+import re
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+from peewee import OperationalError
+
+import database_access
+from database import (
+    Event,
+    EventCategory,
+    Item,
+    ItemStock,
+    Ledger,
+    User,
+    UserBalance,
+    db,
+)
+
+# Hot queries by name, called with placeholder ids: plans do not depend on data
+HOT_QUERIES: Dict[str, Callable] = {
+    "event_get_recent_with_details": lambda: database_access.event_get_recent_with_details(),
+    "event_get_recent_with_details(category)": lambda: database_access.event_get_recent_with_details(
+        category_id=1
+    ),
+    "event_get_latest_by_category": lambda: database_access.event_get_latest_by_category(1),
+    "event_user_has_category_entry_since": lambda: database_access.event_user_has_category_entry_since(
+        1, 1, datetime.now() - timedelta(days=7)
+    ),
+    "ledger_get_balance": lambda: database_access.ledger_get_balance(1),
+    "item_get_all_with_stock": lambda: list(database_access.item_get_all_with_stock()),
+}
+
+
+def _settle_current_plan():
+    # A plan changed by another writer is the expected 409, not a failure
+    plan = database_access.ledger_get_settlement_plan()
+    try:
+        database_access.ledger_settle_all(database_access.ledger_settlement_plan_token(plan))
+    except ValueError:
+        pass
+
+
+# Write paths run concurrently by concurrent_write_failures(), called with
+# (user_id, category_id) of a scratch database
+WRITE_PATHS: Dict[str, Callable] = {
+    "event_create": lambda user_id, category_id: database_access.event_create(
+        user_id=user_id, category_id=category_id, photo_path="", cost=10
+    ),
+    "ledger_add": lambda user_id, category_id: database_access.ledger_add(None, user_id, user_id, 1),
+    "ledger_settle_all": lambda user_id, category_id: _settle_current_plan(),
+    "user_add_if_not_exists": lambda user_id, category_id: database_access.user_add_if_not_exists(
+        f"check-{user_id}-{uuid.uuid4().hex}", b""
+    ),
+}
+
+
+# Scans over these tables are expected: the query lists every row anyway
+FULL_SCAN_ALLOWED = ("item", "user")
+
+
+class _QueryCapture(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.queries: List[Tuple[str, tuple]] = []
+
+    def emit(self, record):
+        if isinstance(record.msg, tuple) and len(record.msg) == 2:
+            sql, params = record.msg
+            self.queries.append((sql, tuple(params or ())))
+
+
+@contextmanager
+def capture_queries():
+    """Collect the (sql, params) of every statement executed in the block."""
+    logger = logging.getLogger("peewee")
+    handler = _QueryCapture()
+    level = logger.level
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    try:
+        yield handler.queries
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+
+
+def explain(sql: str, params: tuple) -> List[str]:
+    """Return the detail lines of SQLite's EXPLAIN QUERY PLAN for a statement."""
+    rows = db.execute_sql(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def table_aliases(sql: str) -> Dict[str, str]:
+    """Map peewee's "t1"-style aliases back to table names."""
+    return {alias: table for table, alias in re.findall(r'"(\w+)" AS "(\w+)"', sql)}
+
+
+def is_full_scan(detail: str, aliases: Dict[str, str]) -> bool:
+    """True for a plan step that walks a whole table instead of an index."""
+    words = detail.split()
+    if len(words) < 2 or words[0] != "SCAN" or "INDEX" in words:
+        return False
+    if words[1:3] == ["CONSTANT", "ROW"]:
+        return False
+    table = words[1].strip('"')
+    return aliases.get(table, table) not in FULL_SCAN_ALLOWED
+
+
+def check_query_plans() -> Dict[str, List[str]]:
+    """
+    Run every hot query and explain what it sent to SQLite.
+    Returns {query name: plan lines}; full table scans are prefixed with "!".
+    """
+    plans = {}
+    with db.connection_context():
+        for name, run in HOT_QUERIES.items():
+            with capture_queries() as queries:
+                run()
+            lines = []
+            for sql, params in queries:
+                aliases = table_aliases(sql)
+                for detail in explain(sql, params):
+                    lines.append(("! " if is_full_scan(detail, aliases) else "  ") + detail)
+            plans[name] = lines
+    return plans
+
+
+def event_listing_query_counts(limits=(1, 10, 50)) -> Dict[int, int]:
+    """
+    Count the statements the event listing issues for each page size,
+    including everything serialization touches. The counts must not grow
+    with the limit.
+    """
+    counts = {}
+    with db.connection_context():
+        for limit in limits:
+            with capture_queries() as queries:
+                for event, _ in database_access.event_get_recent_with_details(limit):
+                    touched = [event.user.name, event.category.name]
+                    touched += [(i.payer.name, i.beneficiary.name) for i in event.ledger_items]
+                    if event.stock:
+                        touched.append(event.stock.item.name)
+            counts[limit] = len(queries)
+    return counts
+
+
+def concurrent_write_failures(pragmas: dict, threads: int = 4, writes: int = 30) -> Dict[str, int]:
+    """
+    Run every write path from several threads at once against a scratch
+    database and count the calls that failed with a locking error.
+    """
+    original = db.database
+    failures = {name: 0 for name in WRITE_PATHS}
+    failures_lock = threading.Lock()
+    with tempfile.TemporaryDirectory() as scratch:
+        database_access.database_configure(os.path.join(scratch, "check.db"), pragmas)
+        try:
+            with db.connection_context():
+                db.create_tables([User, Item, ItemStock, EventCategory, Event, Ledger, UserBalance])
+                user_ids = [User.create(name=f"check-{i}", face_encoding=b"").id for i in range(threads)]
+                category_id = EventCategory.create(name="check", icon="").id
+
+            def worker(user_id):
+                for _ in range(writes):
+                    for name, write in WRITE_PATHS.items():
+                        with db.connection_context():
+                            try:
+                                write(user_id, category_id)
+                            except OperationalError:
+                                with failures_lock:
+                                    failures[name] += 1
+
+            workers = [threading.Thread(target=worker, args=(user_id,)) for user_id in user_ids]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+        finally:
+            database_access.database_configure(original, pragmas)
+    return failures
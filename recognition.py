@@ -1,53 +1,379 @@
+import base64
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, TimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional
+
 import numpy as np
-import face_recognition
-from flask import request
+from flask import g, request
 
-from database_access import user_get_all
-from face_encoding import decode_face_from_bytes
+from face_pipeline import FaceDetection, PipelineSettings
+from gallery import ENCODING_DIM, face_gallery
+from recognition_service import recognition_service
 from response_helpers import json_error, json_response
+from timing import StageTimer, stage_metrics
+
+
+def decode_probe_encoding(raw: bytes) -> np.ndarray:
+    """Parse a client-computed encoding sent as raw little-endian float32."""
+    if len(raw) != ENCODING_DIM * 4:
+        raise ValueError(
+            f"Encoding must be {ENCODING_DIM} float32 values ({ENCODING_DIM * 4} bytes)"
+        )
+    encoding = np.frombuffer(raw, dtype="<f4")
+    if not np.all(np.isfinite(encoding)):
+        raise ValueError("Encoding contains non-finite values")
+    return encoding
+
+
+def _worker_lost(future: Future) -> bool:
+    """True if a finished job never ran to completion because of its worker pool."""
+    return future.cancelled() or isinstance(future.exception(), BrokenProcessPool)
+
+
+class _CacheEntry:
+    def __init__(self, faces: List[FaceDetection]):
+        self.faces = faces
+        self.created_at = time.monotonic()
+        # (gallery version, MatchResult), replaced as one value under the cache lock
+        self.result: Optional[tuple] = None
+
+
+class RecognitionCache:
+    """
+    Bounded LRU cache with TTL, keyed by the SHA-256 of an uploaded image.
+
+    Entries keep the detected faces (which only depend on the image) and the
+    match result together with the gallery version it was computed against.
+    A gallery change invalidates the match but not the detection, so a retry
+    after a new user is enrolled only re-runs the cheap matcher.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_matches = 0
+        self.evictions = 0
+
+    @staticmethod
+    def digest(image_bytes: bytes) -> str:
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    def get(self, digest: str) -> Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and time.monotonic() - entry.created_at > self.ttl:
+                del self._entries[digest]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry
+
+    def put(self, digest: str, faces: List[FaceDetection]) -> _CacheEntry:
+        entry = _CacheEntry(faces)
+        with self._lock:
+            self._entries[digest] = entry
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def match(self, entry: _CacheEntry, gallery, compute):
+        """Return the entry's match for this gallery version, recomputing if stale."""
+        with self._lock:
+            cached = entry.result
+        if cached is not None and cached[0] == gallery.version:
+            return cached[1]
+        match = compute()
+        with self._lock:
+            if cached is not None:
+                self.stale_matches += 1
+            # A concurrent retry may have stored a match for a newer gallery
+            if entry.result is None or entry.result[0] <= gallery.version:
+                entry.result = (gallery.version, match)
+        return match
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stale_matches": self.stale_matches,
+                "evictions": self.evictions,
+            }
 
 
 def routes(app):
+    result_cache = RecognitionCache(
+        app.config["FACE_CACHE_SIZE"], app.config["FACE_CACHE_TTL"]
+    )
+    recognition_service.configure(
+        app.config["FACE_WORKERS"], PipelineSettings.from_config(app.config)
+    )
+    recognition_service.warm_up()
+    face_gallery.configure(
+        app.config["FACE_INDEX_THRESHOLD"], app.config["FACE_INDEX_NPROBE"]
+    )
+
+    @app.after_request
+    def add_server_timing(response):
+        """Expose the stage timings of recognition requests and record them."""
+        timer = g.pop("stage_timer", None)
+        if timer is not None:
+            response.headers["Server-Timing"] = timer.header()
+            stage_metrics.record(request.endpoint, timer.finish())
+        return response
+
+    def record_worker_timings(timer: StageTimer, timings: dict):
+        for name, duration in timings.items():
+            timer.add(name, duration)
+
+    def match_encoding(gallery, encoding):
+        return gallery.matcher.match(
+            encoding,
+            tolerance=app.config["FACE_TOLERANCE"],
+            k=app.config["FACE_KNN"],
+        )
+
+    def detect_cached(image_bytes: bytes, timer: StageTimer) -> _CacheEntry:
+        """Detect faces, reusing the result for bytes seen recently."""
+        with timer.stage("cache"):
+            digest = result_cache.digest(image_bytes)
+            entry = result_cache.get(digest)
+        if entry is None:
+            started = time.perf_counter()
+            try:
+                faces, timings = recognition_service.detect(image_bytes).result(
+                    timeout=app.config["FACE_TIMEOUT"]
+                )
+            except BrokenProcessPool:
+                # The worker died under this job; submit() replaces the pool, so retry once
+                faces, timings = recognition_service.detect(image_bytes).result(
+                    timeout=app.config["FACE_TIMEOUT"]
+                )
+            waited = (time.perf_counter() - started) * 1000.0
+            record_worker_timings(timer, timings)
+            # Whatever the worker did not account for was spent queued or in IPC
+            timer.add("queue", max(0.0, waited - sum(timings.values())))
+            entry = result_cache.put(digest, faces)
+        return entry
+
+    def match_response(gallery, match, **extra):
+        if match.is_match:
+            return json_response(
+                {
+                    "user": {
+                        "id": int(gallery.user_ids[match.index]),
+                        "name": gallery.names[match.index],
+                    },
+                    "confidence": match.confidence,
+                    "margin": match.margin,
+                    "votes": match.votes,
+                    **extra,
+                }
+            )
+
+        return json_error("Face not recognized", 404, confidence=match.confidence)
+
     @app.route("/face/recognize", methods=["POST"])
     def perform_face_recognition():
         """Recognize a face from an uploaded photo and return the matched user."""
-        photo = request.files.get("photo") or request.files.get("image")
-        if not photo or not photo.filename:
-            return json_error("Photo is required", 400)
+        timer = g.stage_timer = StageTimer()
+        with timer.stage("upload"):
+            photo = request.files.get("photo") or request.files.get("image")
+            if not photo or not photo.filename:
+                return json_error("Photo is required", 400)
+            photo.stream.seek(0)
+            image_bytes = photo.stream.read()
 
-        users = list(user_get_all())
-        if not users:
+        with timer.stage("gallery"):
+            gallery = face_gallery.snapshot()
+        if not gallery.names:
             return json_error("No registered users", 404)
 
         try:
-            photo.stream.seek(0)
-            image = face_recognition.load_image_file(photo)
-            encodings = face_recognition.face_encodings(image)
+            entry = detect_cached(image_bytes, timer)
+        except TimeoutError:
+            return json_error("Face recognition timed out", 503)
+        except (BrokenProcessPool, CancelledError):
+            return json_error("Face recognition workers unavailable", 503)
         except Exception:
             return json_error("Invalid image data", 400)
+        faces = entry.faces
 
-        if not encodings:
+        if not faces:
             return json_error("No recognizable faces found", 400)
 
-        if len(encodings) > 1:
+        if len(faces) > 1:
             return json_error("Multiple faces detected. Submit a photo with a single person.", 400)
 
-        target_encoding = encodings[0]
-        known_encodings = [decode_face_from_bytes(user.face_encoding) for user in users]
-        matches = face_recognition.compare_faces(known_encodings, target_encoding)
-        distances = face_recognition.face_distance(known_encodings, target_encoding)
+        with timer.stage("match"):
+            match = result_cache.match(
+                entry, gallery, lambda: match_encoding(gallery, faces[0].encoding)
+            )
+        return match_response(gallery, match, location=faces[0].location)
+
+    @app.route("/face/cache")
+    def recognition_cache_stats():
+        """Hit/miss counters of the recognition result cache."""
+        return json_response(result_cache.stats())
 
-        best_index = int(np.argmin(distances))
-        confidence = max(0.0, 1.0 - float(distances[best_index]))
+    @app.route("/metrics")
+    def recognition_metrics():
+        """Rolling per-stage latency percentiles (ms) and cache counters."""
+        return json_response(
+            {"endpoints": stage_metrics.snapshot(), "cache": result_cache.stats()}
+        )
 
-        if matches[best_index]:
-            user = users[best_index]
-            return json_response(
-                {
-                    "user": {"id": user.id, "name": user.name},
-                    "confidence": confidence,
-                }
+    @app.route("/face/recognize/batch", methods=["POST"])
+    def perform_batch_face_recognition():
+        """
+        Recognize a face from several frames of the same person and vote.
+        Frames without exactly one face are skipped; the remaining encodings
+        are matched in one call and the user matched by most frames wins.
+        """
+        timer = g.stage_timer = StageTimer()
+        with timer.stage("upload"):
+            photos = [
+                photo
+                for photo in request.files.getlist("photos") + request.files.getlist("photo")
+                if photo.filename
+            ]
+            frames_bytes = [photo.stream.read() for photo in photos]
+        if not photos:
+            return json_error("At least one photo is required", 400)
+
+        with timer.stage("gallery"):
+            gallery = face_gallery.snapshot()
+        if not gallery.names:
+            return json_error("No registered users", 404)
+
+        # Frames are detected in parallel across the worker pool; "wait" is
+        # the wall time, the worker stages are summed over frames
+        with timer.stage("wait"):
+            futures = [recognition_service.detect(frame) for frame in frames_bytes]
+            _, pending = wait(futures, timeout=app.config["FACE_TIMEOUT"])
+        if pending:
+            for future in pending:
+                future.cancel()
+            return json_error("Face recognition timed out", 503)
+
+        # Frames lost with a crashed worker are resubmitted once to the replaced pool
+        lost = [i for i, future in enumerate(futures) if _worker_lost(future)]
+        if lost:
+            with timer.stage("wait"):
+                for i in lost:
+                    futures[i] = recognition_service.detect(frames_bytes[i])
+                _, pending = wait([futures[i] for i in lost], timeout=app.config["FACE_TIMEOUT"])
+            if pending:
+                for future in pending:
+                    future.cancel()
+                return json_error("Face recognition timed out", 503)
+            if any(_worker_lost(futures[i]) for i in lost):
+                return json_error("Face recognition workers unavailable", 503)
+
+        encodings = []
+        for future in futures:
+            if future.exception() is not None:
+                continue
+            faces, timings = future.result()
+            record_worker_timings(timer, timings)
+            if len(faces) == 1:
+                encodings.append(faces[0].encoding)
+
+        frames = {"total": len(photos), "used": len(encodings), "agreeing": 0}
+        if not encodings:
+            return json_error("No frame contained exactly one recognizable face", 400, frames=frames)
+
+        with timer.stage("match"):
+            matches = gallery.matcher.match_many(
+                np.vstack(encodings),
+                tolerance=app.config["FACE_TOLERANCE"],
+                k=app.config["FACE_KNN"],
             )
+        winners = np.array([m.index if m.is_match else -1 for m in matches])
+        distances = np.array([m.distance for m in matches])
+        labels, counts = np.unique(winners[winners >= 0], return_counts=True)
+        if labels.size == 0:
+            return json_error(
+                "Face not recognized",
+                404,
+                confidence=max(0.0, 1.0 - float(distances.min())),
+                frames=frames,
+            )
+
+        # Most agreeing frames wins, ties go to the closer mean distance
+        mean_distances = np.array([distances[winners == label].mean() for label in labels])
+        best = np.lexsort((mean_distances, -counts))[0]
+        label = int(labels[best])
+        frames["agreeing"] = int(counts[best])
+        agreement = frames["agreeing"] / frames["used"]
+        confidence = max(0.0, 1.0 - float(mean_distances[best]))
+
+        if agreement < app.config["FACE_MIN_AGREEMENT"]:
+            return json_error("Face not recognized", 404, confidence=confidence, frames=frames)
 
-        return json_error("Face not recognized", 404, confidence=confidence)
+        return json_response(
+            {
+                "user": {
+                    "id": int(gallery.user_ids[label]),
+                    "name": gallery.names[label],
+                },
+                "confidence": confidence,
+                "agreement": agreement,
+                "frames": frames,
+            }
+        )
+
+    @app.route("/face/recognize/encoding", methods=["POST"])
+    def perform_encoding_recognition():
+        """
+        Match a 128-d encoding computed by the client against the gallery.
+        Accepts the raw float32 bytes as an application/octet-stream body, or
+        base64 of those bytes in an "encoding" form or JSON field.
+        """
+        timer = g.stage_timer = StageTimer()
+        with timer.stage("upload"):
+            try:
+                if request.mimetype == "application/octet-stream":
+                    raw = request.get_data()
+                else:
+                    payload = request.get_json(silent=True)
+                    if payload is None:
+                        payload = request.form
+                    if not isinstance(payload, dict):
+                        return json_error("Request body must be a JSON object", 400)
+                    encoded = payload.get("encoding")
+                    if not encoded:
+                        return json_error("Encoding is required", 400)
+                    if not isinstance(encoded, str):
+                        return json_error("Encoding must be a base64 string", 400)
+                    raw = base64.b64decode(encoded, validate=True)
+                encoding = decode_probe_encoding(raw)
+            except ValueError as e:
+                return json_error(f"Invalid encoding: {str(e)}", 400)
+
+        with timer.stage("gallery"):
+            gallery = face_gallery.snapshot()
+        if not gallery.names:
+            return json_error("No registered users", 404)
 
+        with timer.stage("match"):
+            match = match_encoding(gallery, encoding)
+        return match_response(gallery, match)
@@ -0,0 +1,107 @@
+"""Long-lived worker processes for dlib face detection and encoding."""
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+from face_pipeline import FaceDetection, PipelineSettings
+
+# Settings of the current worker process, set by _init_worker
+_worker_settings: Optional[PipelineSettings] = None
+
+
+def _init_worker(settings: PipelineSettings):
+    """Load dlib's models once per worker instead of once per request."""
+    global _worker_settings
+    import face_recognition  # noqa: F401
+
+    _worker_settings = settings
+
+
+def _detect(image_bytes: bytes) -> Tuple[List[FaceDetection], Dict[str, float]]:
+    from face_pipeline import detect_faces
+
+    timings = {}
+    faces = detect_faces(io.BytesIO(image_bytes), _worker_settings, timings)
+    return faces, timings
+
+
+def _ready() -> bool:
+    return True
+
+
+class RecognitionService:
+    """
+    Pool of N worker processes that keep dlib loaded and take jobs off a queue.
+
+    Request threads only submit work and wait on the returned future, so a
+    slow detection holds up neither the GIL nor any other route. Workers are
+    forked explicitly: spawned workers would re-import app.py as __main__,
+    re-running database_init and starting pools of their own. The pool is
+    warmed up at startup, before the server starts its request threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.workers = os.cpu_count() or 1
+        self.settings = PipelineSettings()
+
+    def configure(self, workers: int, settings: PipelineSettings):
+        """Set pool size and pipeline settings; restarts a running pool."""
+        with self._lock:
+            self.workers = workers
+            self.settings = settings
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("fork"),
+                    initializer=_init_worker,
+                    initargs=(self.settings,),
+                )
+            return self._executor
+
+    def warm_up(self):
+        """Start every worker now so the first request does not pay for it."""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(_ready)
+
+    def submit(self, fn, *args) -> Future:
+        """Run a picklable function on a worker, replacing a crashed pool once."""
+        executor = self._get_executor()
+        try:
+            return executor.submit(fn, *args)
+        except BrokenProcessPool:
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            return self._get_executor().submit(fn, *args)
+
+    def detect(self, image_bytes: bytes) -> Future:
+        """
+        Detect and encode faces in an image. Resolves to the faces and the
+        per-stage durations (ms) measured in the worker.
+        """
+        return self.submit(_detect, image_bytes)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Logins and enrollments get separate pools: enrollment encodes many
+# full-resolution photos and must never queue ahead of a kiosk login.
+recognition_service = RecognitionService()
+enrollment_service = RecognitionService()
@@ -0,0 +1,91 @@
+"""Per-stage request timers, Server-Timing headers and rolling latency histograms."""
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict
+
+import numpy as np
+
+WINDOW_SIZE = 1000  # Most recent samples kept per stage
+
+
+class StageTimer:
+    """Collects the duration of the named stages of one request, in milliseconds."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: "OrderedDict[str, float]" = OrderedDict()
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - started) * 1000.0)
+
+    def add(self, name: str, duration_ms: float):
+        """Record a stage measured elsewhere, e.g. inside a worker process."""
+        self.stages[name] = self.stages.get(name, 0.0) + duration_ms
+
+    def finish(self) -> Dict[str, float]:
+        """Stop the clock; returns the stages plus the whole request as "total"."""
+        if "total" not in self.stages:
+            self.stages["total"] = (time.perf_counter() - self.started) * 1000.0
+        return dict(self.stages)
+
+    def header(self) -> str:
+        """Format the stages as a Server-Timing header value."""
+        return ", ".join(
+            f"{name};dur={duration:.1f}" for name, duration in self.finish().items()
+        )
+
+
+class StageHistograms:
+    """
+    Rolling window of the last WINDOW_SIZE durations per endpoint and stage.
+    Percentiles are computed on read, so recording stays a deque append.
+    """
+
+    def __init__(self, window: int = WINDOW_SIZE):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Dict[str, deque]] = {}
+        self._counts: Dict[str, int] = {}
+
+    def record(self, endpoint: str, stages: Dict[str, float]):
+        with self._lock:
+            per_stage = self._samples.setdefault(endpoint, {})
+            for name, duration in stages.items():
+                per_stage.setdefault(name, deque(maxlen=self.window)).append(duration)
+            self._counts[endpoint] = self._counts.get(endpoint, 0) + 1
+
+    def snapshot(self) -> dict:
+        """Return count, mean and p50/p95/p99/max in ms per endpoint and stage."""
+        with self._lock:
+            samples = {
+                endpoint: {name: list(values) for name, values in stages.items()}
+                for endpoint, stages in self._samples.items()
+            }
+            counts = dict(self._counts)
+
+        result = {}
+        for endpoint, stages in samples.items():
+            summary = {}
+            for name, values in stages.items():
+                values = np.asarray(values)
+                p50, p95, p99 = np.percentile(values, [50, 95, 99])
+                summary[name] = {
+                    "count": int(values.size),
+                    "mean": float(values.mean()),
+                    "p50": float(p50),
+                    "p95": float(p95),
+                    "p99": float(p99),
+                    "max": float(values.max()),
+                }
+            result[endpoint] = {"requests": counts[endpoint], "stages": summary}
+        return result
+
+
+stage_metrics = StageHistograms()
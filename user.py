@@ -1,21 +1,22 @@
-from flask import Response, render_template, request
-from werkzeug.utils import secure_filename
-import os
+from flask import Response, render_template, request, url_for
 
 from database_access import (
     user_get_all,
-    user_add,
     user_exists,
     ledger_get_all_balances,
 )
-from face_encoding import (
-    encode_face_from_image,
-    average_encodings,
-    encode_face_to_bytes,
-)
+from enrollment import enrollment_get, enrollment_submit
+from face_pipeline import PipelineSettings
+from recognition_service import enrollment_service
 from response_helpers import json_error, json_response, wants_json_response
 
 def routes(app):
+    enrollment_service.configure(
+        app.config["FACE_ENROLL_WORKERS"], PipelineSettings.from_config(app.config)
+    )
+    # Forked now, before the server starts its request threads
+    enrollment_service.warm_up()
+
     @app.route("/users")
     def user_list():
         """List all users."""
@@ -48,7 +49,7 @@ def routes(app):
 
     @app.route("/users", methods=["POST"])
     def user_add_handle():
-        """Handle user creation."""
+        """Queue a background enrollment job for a new user."""
         name = request.form.get('name')
         if not name:
             if wants_json_response():
@@ -66,59 +67,37 @@ def routes(app):
                 return json_error("At least one image is required", 400)
             return render_template('dialogs/error.html', error="At least one image is required"), 400
     
-        # Process all images and combine encodings
-        encodings = []
-        temp_files = []
-    
-        try:
-            for file in files:
-                if file.filename:
-                    filename = secure_filename(file.filename)
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    file.save(filepath)
-                    temp_files.append(filepath)
-                
-                    encoding = encode_face_from_image(filepath)
-                    if encoding is not None:
-                        encodings.append(encoding)
-        
-            if not encodings:
-                return render_template('dialogs/error.html', error="No faces detected in images"), 400
-        
-            # Average all encodings
-            avg_encoding = average_encodings(encodings)
-            face_encoding_bytes = encode_face_to_bytes(avg_encoding)
-        
-            # Create user
-            new_user = user_add(name, face_encoding_bytes)
-        
+        images = [file.read() for file in files if file.filename]
+        job = enrollment_submit(name, images)
+        status_url = url_for('user_enrollment_status', job_id=job.id)
+
+        if wants_json_response():
+            resp, status = json_response({"job": job.to_dict(), "status_url": status_url}, 202)
+            resp.headers['Location'] = status_url
+            return resp, status
+
+        return render_template('dialogs/enrollment_status.html', job=job, status_url=status_url), 202
+
+
+    @app.route("/users/jobs/<job_id>")
+    def user_enrollment_status(job_id):
+        """Report the progress of a background enrollment job."""
+        job = enrollment_get(job_id)
+        if job is None:
             if wants_json_response():
-                return json_response(
-                    {
-                        "message": f'User "{name}" added successfully!',
-                        "user": {
-                            "id": new_user.id,
-                            "name": new_user.name,
-                            "created_at": new_user.created_at.isoformat(),
-                        },
-                    }
-                )
+                return json_error("Enrollment job not found", 404)
+            return render_template('dialogs/error.html', error="Enrollment job not found"), 404
+
+        if wants_json_response():
+            return json_response({"job": job.to_dict()})
 
-            resp = render_template('dialogs/success.html', message=f'User "{name}" added successfully!')
+        # Polling fragments are always 200 so htmx swaps the final dialog in
+        if job.status == job.FAILED:
+            return render_template('dialogs/error.html', error=job.error)
+        if job.status == job.DONE:
+            resp = render_template('dialogs/success.html', message=f'User "{job.name}" added successfully!')
             resp = Response(resp)
             resp.headers['HX-Trigger'] = 'userUpdated'
             return resp
-    
-        except Exception as e:
-            if wants_json_response():
-                return json_error(str(e), 400)
-            return render_template('dialogs/error.html', error=f"Error: {str(e)}"), 400
-    
-        finally:
-            # Clean up temporary files
-            for filepath in temp_files:
-                try:
-                    os.remove(filepath)
-                except:
-                    pass
-
+        status_url = url_for('user_enrollment_status', job_id=job.id)
+        return render_template('dialogs/enrollment_status.html', job=job, status_url=status_url)